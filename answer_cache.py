@@ -0,0 +1,111 @@
+import json
+import time
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+
+from spec_index import normalize_text
+
+_TRAILING_PUNCTUATION = "？?。.!！~～ "
+
+
+# 問題正規化：全形轉半形、移除空白、轉小寫並去掉結尾標點，讓「A012 適用哪些流體？」與「a012適用哪些流體」視為同一題
+def normalize_question(question):
+    return normalize_text(unicodedata.normalize("NFKC", question or "")).rstrip(_TRAILING_PUNCTUATION)
+
+
+# GPT 回答快取：以 (正規化問題, file_id, 模型參數) 為 key，LRU 上限 + TTL；
+# 同一題正在向 GPT 查詢時，後到的請求不再重複呼叫，改為等同一個結果（singleflight）
+class AnswerCache:
+    def __init__(self, max_entries=500, ttl_seconds=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._items = OrderedDict()  # {key: (created, answer)}
+        self._inflight = {}  # {key: {user_id: on_done}}，發起查詢的使用者 on_done 為 None
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(question, file_id, params):
+        return (normalize_question(question), file_id or "", json.dumps(params, sort_keys=True))
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.time() - item[0] <= self.ttl_seconds:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, answer):
+        with self._lock:
+            self._put(key, answer)
+
+    def _put(self, key, answer):
+        self._items[key] = (time.time(), answer)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    # 登記一次查詢：回傳 True 代表由呼叫者負責向 GPT 查詢，完成後呼叫 complete / fail；
+    # 回傳 False 代表同一題已在查詢中，結果出來時會以 on_done(answer) 通知（同一使用者重送的請求只通知一次）
+    def begin(self, key, user_id, on_done):
+        with self._lock:
+            waiters = self._inflight.get(key)
+            if waiters is None:
+                self._inflight[key] = {user_id: None}
+                return True
+            self.coalesced += 1
+            waiters.setdefault(user_id, on_done)
+            return False
+
+    # 查詢成功：寫入快取並通知等待中的使用者
+    def complete(self, key, answer):
+        with self._lock:
+            waiters = self._inflight.pop(key, {})
+            self._put(key, answer)
+        self._notify(waiters, answer)
+
+    # 查詢失敗：不寫入快取，等待中的使用者收到 reply（通常是錯誤訊息）
+    def fail(self, key, reply):
+        with self._lock:
+            waiters = self._inflight.pop(key, {})
+        self._notify(waiters, reply)
+
+    @staticmethod
+    def _notify(waiters, text):
+        for on_done in waiters.values():
+            if on_done is None:
+                continue
+            try:
+                on_done(text)
+            except Exception as e:
+                print("❌ 通知等待中的使用者失敗:", e)
+
+    # 清除指定 file_id 的快取（PDF 更新、換了 file id 時呼叫）；不指定則全部清除
+    def invalidate(self, file_id=None):
+        with self._lock:
+            if file_id is None:
+                removed = len(self._items)
+                self._items.clear()
+                return removed
+            stale = [key for key in self._items if key[1] == file_id]
+            for key in stale:
+                del self._items[key]
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+            }
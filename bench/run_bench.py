@@ -0,0 +1,216 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.scenarios import SCENARIOS, context_from_response, dialogflow_payload
+from bench.stub_servers import StubConfig, StubServer
+
+# 基準測試：以本機 OpenAI / LINE 替身重播各 intent 的 Dialogflow 請求，統計延遲分位數、固定併發下的吞吐量與推播完成時間
+#
+#   python -m bench.run_bench                          # 在同一個 process 內以 Flask test client 測試
+#   python -m bench.run_bench --save baseline.json     # 存成基準
+#   python -m bench.run_bench --compare baseline.json  # 與基準比較
+#   LINE_REPLY_TOKEN_DELIVERY=1 python -m bench.run_bench  # 背景回答改用 reply token 送出
+#   python -m bench.run_bench --target http://127.0.0.1:5000/webhook --stub-port 18080
+#       測試已啟動的服務（例如 gunicorn），服務需以
+#       OPENAI_BASE_URL=http://127.0.0.1:18080/v1 LINE_API_BASE=http://127.0.0.1:18080 啟動
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class InProcessClient:
+    def __init__(self, stub_url):
+        # 必須在 import webhook 之前設定，http_client 在 import 時讀取這些設定
+        os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+        os.environ["LINE_API_BASE"] = stub_url
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+        os.environ.setdefault("TRANSLATION_CACHE_PATH", "")
+        os.chdir(REPO_ROOT)
+        sys.path.insert(0, REPO_ROOT)
+        import webhook
+        self.webhook = webhook
+        self.client = webhook.app.test_client()
+
+    def post(self, payload):
+        response = self.client.post("/webhook", json=payload)
+        return response.status_code, response.get_json()
+
+    # 背景 GPT 工作都完成後才算推播結束
+    def idle(self):
+        stats = self.webhook.gpt_executor.stats()
+        return stats["queued"] == 0 and stats["running"] == 0
+
+
+class HttpClient:
+    def __init__(self, target):
+        import requests
+        self.target = target
+        self.session = requests.Session()
+
+    def post(self, payload):
+        response = self.session.post(self.target, json=payload, timeout=30)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    def idle(self):
+        return True
+
+
+def run_scenario(client, stub, scenario, requests_count, concurrency, settle_seconds, push_timeout, run_id):
+    stub.reset()
+    started = {}
+
+    def one(i):
+        session = f"projects/bench/agent/sessions/{run_id}-{scenario.name}-{i}"
+        user_id = f"U{run_id}{scenario.name}{i}"
+        context = scenario.context
+        if scenario.setup:
+            query, intent, setup_context = scenario.setup
+            _, response = client.post(dialogflow_payload(session, user_id, query, intent, setup_context))
+            context = context_from_response(response)
+        payload = dialogflow_payload(session, user_id, scenario.query, scenario.intent, context)
+        start = time.monotonic()
+        started[user_id] = start
+        status, _ = client.post(payload)
+        return time.monotonic() - start, status
+
+    wall_start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests_count)))
+    wall = time.monotonic() - wall_start
+
+    # 等背景工作結束，且一段時間內沒有新的推播
+    deadline = time.monotonic() + push_timeout
+    while time.monotonic() < deadline:
+        last_push = stub.last_push_time()
+        if last_push is None:
+            done = client.idle() and not scenario.expects_push
+        else:
+            done = client.idle() and time.monotonic() - last_push >= settle_seconds
+        if done:
+            break
+        time.sleep(0.05)
+
+    latencies = [latency * 1000 for latency, _ in results]
+    push_first, push_last = [], []
+    with stub.lock:
+        for user_id, times in stub.pushes.items():
+            if user_id in started:
+                push_first.append((times[0] - started[user_id]) * 1000)
+                push_last.append((times[-1] - started[user_id]) * 1000)
+        counts = dict(stub.counts)
+
+    return {
+        "requests": requests_count,
+        "errors": sum(1 for _, status in results if status != 200),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": requests_count / wall if wall else None,
+        "pushed_users": len(push_last),
+        "first_push_p50_ms": percentile(push_first, 50),
+        "push_done_p50_ms": percentile(push_last, 50),
+        "push_done_p95_ms": percentile(push_last, 95),
+        "openai_calls": counts["chat"],
+        "pushes": counts["push"],
+        "replies": counts["reply"],
+    }
+
+
+def _fmt(value, digits=1):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_report(report, baseline=None):
+    header = f"{'scenario':<24}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'err':>5}{'push':>6}{'1st p50':>10}{'done p50':>10}{'done p95':>10}{'gpt':>6}{'line':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report["scenarios"].items():
+        print(
+            f"{name:<24}{_fmt(row['p50_ms']):>9}{_fmt(row['p95_ms']):>9}{_fmt(row['p99_ms']):>9}"
+            f"{_fmt(row['throughput_rps']):>9}{row['errors']:>5}{row['pushed_users']:>6}"
+            f"{_fmt(row['first_push_p50_ms'], 0):>10}{_fmt(row['push_done_p50_ms'], 0):>10}"
+            f"{_fmt(row['push_done_p95_ms'], 0):>10}{row['openai_calls']:>6}{row['pushes'] + row.get('replies', 0):>6}"
+        )
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base:
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "throughput_rps", "push_done_p50_ms"):
+                if base.get(key) and row.get(key) is not None:
+                    deltas.append(f"{key} {100 * (row[key] - base[key]) / base[key]:+.0f}%")
+            print(f"{'  vs baseline':<24}{', '.join(deltas)}")
+    print("（延遲單位 ms；push = 收到推播的使用者數，1st / done = 從送出請求到第一則 / 最後一則推播，line = LINE API 呼叫數）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以本機 OpenAI / LINE 替身重播 webhook 請求並統計延遲")
+    parser.add_argument("--scenarios", nargs="*", help="只執行指定情境（預設全部）")
+    parser.add_argument("--requests", type=int, default=40, help="每個情境的請求數")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時送出的請求數")
+    parser.add_argument("--target", help="測試已啟動的服務（webhook URL），不指定則在本 process 內測試")
+    parser.add_argument("--stub-port", type=int, default=0, help="替身伺服器的 port（測試外部服務時需固定）")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-failure-rate", type=float, default=0.0)
+    parser.add_argument("--openai-failure-status", type=int, default=500)
+    parser.add_argument("--line-latency", type=float, default=0.02)
+    parser.add_argument("--line-failure-rate", type=float, default=0.0)
+    parser.add_argument("--line-failure-status", type=int, default=500, help="例如 429 測試 Retry-After 退避")
+    parser.add_argument("--answer-chars", type=int, default=400)
+    parser.add_argument("--settle", type=float, default=1.0, help="多久沒有新推播就視為推播完成（秒）")
+    parser.add_argument("--push-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="把結果存成 JSON（作為之後比較的基準）")
+    parser.add_argument("--compare", help="與先前存下的 JSON 基準比較")
+    args = parser.parse_args()
+
+    stub = StubServer(StubConfig(
+        openai_latency=args.openai_latency,
+        openai_failure_rate=args.openai_failure_rate,
+        openai_failure_status=args.openai_failure_status,
+        line_latency=args.line_latency,
+        line_failure_rate=args.line_failure_rate,
+        line_failure_status=args.line_failure_status,
+        answer_chars=args.answer_chars,
+        seed=args.seed,
+    ), port=args.stub_port).start()
+    print(f"🧪 OpenAI / LINE 替身：{stub.base_url}")
+
+    client = HttpClient(args.target) if args.target else InProcessClient(stub.base_url)
+    scenarios = [s for s in SCENARIOS if not args.scenarios or s.name in args.scenarios]
+    run_id = str(int(time.time()))
+
+    report = {"settings": vars(args), "scenarios": {}}
+    for scenario in scenarios:
+        print(f"▶️ {scenario.name}")
+        report["scenarios"][scenario.name] = run_scenario(
+            client, stub, scenario, args.requests, args.concurrency, args.settle, args.push_timeout, run_id
+        )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果已寫入 {args.save}")
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
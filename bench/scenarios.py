@@ -0,0 +1,50 @@
+# 每個 intent / context flag 一個情境；setup 先送出一次查詢，把回應中的 spec-context 參數當成這次請求的 context
+
+
+class Scenario:
+    def __init__(self, name, query, intent="", context=None, setup=None, expects_push=False):
+        self.name = name
+        self.query = query
+        self.intent = intent
+        self.context = context
+        self.setup = setup  # (query, intent, context)，回應的 context 參數交給正式請求使用
+        self.expects_push = expects_push
+
+
+SCENARIOS = [
+    Scenario("spec_search", "試壓"),
+    Scenario("spec_more", "更多", setup=("試壓", "", None)),
+    Scenario("spec_selection", "1", setup=("試壓", "", None)),
+    Scenario("heat_mode", "焊後熱處理保溫時間", "Default Fallback Intent", {"await_heat_question": True}),
+    Scenario("heat_rule", "P-No.4 NPS 8 厚度 12mm 後熱", "Default Fallback Intent", {"await_heat_question": True}),
+    Scenario("grade_download", "A012", "下載管線等級"),
+    Scenario("grade_download_context", "a14", "Default Fallback Intent", {"await_pipinclass_download": True}),
+    Scenario("support_type", "TYPE 1", "管支撐規範"),
+    Scenario("support_m", "M-12", "管支撐規範"),
+    Scenario("pipe_class_gpt", "A012 的閥門要用什麼？", "詢問管線等級問題回答", expects_push=True),
+    Scenario("design_question", "管架間距如何決定？", "設計問題集"),
+    Scenario("gpt_fallback", "請說明管線應力分析的重點", "Default Fallback Intent", expects_push=True),
+]
+
+
+def dialogflow_payload(session, user_id, query, intent="", context=None):
+    return {
+        "session": session,
+        "queryResult": {
+            "queryText": query,
+            "intent": {"displayName": intent},
+            "outputContexts": [
+                {"name": f"{session}/contexts/spec-context", "parameters": context}
+            ] if context else [],
+        },
+        "originalDetectIntentRequest": {
+            "payload": {"data": {"source": {"userId": user_id}, "replyToken": f"reply-{user_id}"}}
+        },
+    }
+
+
+def context_from_response(response):
+    for context in (response or {}).get("outputContexts", []):
+        if "spec-context" in context.get("name", "") and context.get("lifespanCount", 1):
+            return context.get("parameters")
+    return None
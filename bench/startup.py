@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from bench.run_bench import REPO_ROOT, percentile
+from bench.scenarios import dialogflow_payload
+
+# 冷啟動報告：每次開一個新的 Python process，量測從啟動到第一個 webhook 回應的時間，並以 -X importtime 統計各套件的匯入時間
+#
+#   python -m bench.startup                 # 使用索引快照（需先執行 python knowledge.py）
+#   python -m bench.startup --no-snapshot   # 不用快照，由 JSON 建立索引
+
+CHILD_SCRIPT = """
+import json, sys, time
+import webhook
+response = webhook.app.test_client().post("/webhook", json=json.loads(sys.argv[1]))
+print("STARTUP_RESULT " + json.dumps({
+    "first_response_at": time.time(),
+    "status": response.status_code,
+    "phases": webhook.startup_phases,
+    "from_snapshot": webhook.knowledge_base.from_snapshot,
+}))
+"""
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def child_env(use_snapshot):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+    env["TRANSLATION_CACHE_PATH"] = ""
+    env["KNOWLEDGE_RELOAD_INTERVAL"] = "0"
+    if not use_snapshot:
+        env["KNOWLEDGE_SNAPSHOT_PATH"] = ""
+    return env
+
+
+def cold_start(payload, use_snapshot, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD_SCRIPT, json.dumps(payload)]
+    started = time.time()
+    result = subprocess.run(command, cwd=REPO_ROOT, env=child_env(use_snapshot), capture_output=True, text=True)
+    line = next((line for line in result.stdout.splitlines() if line.startswith("STARTUP_RESULT ")), None)
+    if line is None:
+        raise SystemExit(f"❌ 子 process 沒有回應：\n{result.stderr[-2000:]}")
+    report = json.loads(line[len("STARTUP_RESULT "):])
+    report["first_response_ms"] = (report.pop("first_response_at") - started) * 1000
+    report["importtime"] = result.stderr if importtime else ""
+    return report
+
+
+# 依最上層套件加總 self time（ms）；site 等直譯器啟動時就載入的模組不算在內
+def imports_by_package(importtime_output):
+    totals = defaultdict(float)
+    inside_child = False
+    for line in importtime_output.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, _, indent, name = match.groups()
+        if name == "site" and not indent.strip(" "):
+            inside_child = True
+            continue
+        if inside_child:
+            totals[name.split(".")[0]] += int(self_us) / 1000
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測冷啟動到第一個 webhook 回應的時間與匯入時間分佈")
+    parser.add_argument("--runs", type=int, default=5, help="冷啟動次數")
+    parser.add_argument("--no-snapshot", action="store_true", help="不使用索引快照")
+    parser.add_argument("--top", type=int, default=12, help="列出匯入時間最長的前幾個套件")
+    args = parser.parse_args()
+
+    use_snapshot = not args.no_snapshot
+    payload = dialogflow_payload("projects/bench/agent/sessions/startup", "Ustartup", "試壓")
+    runs = [cold_start(payload, use_snapshot) for _ in range(args.runs)]
+    profiled = cold_start(payload, use_snapshot, importtime=True)
+
+    first = [run["first_response_ms"] for run in runs]
+    print(f"🧊 冷啟動 {args.runs} 次（索引快照：{'、'.join(runs[0]['from_snapshot']) or '未使用'}）")
+    print(f"  啟動到第一個回應  p50 {percentile(first, 50):.0f} ms  最慢 {max(first):.0f} ms")
+    for phase in runs[0]["phases"]:
+        values = [run["phases"][phase] for run in runs]
+        print(f"  webhook {phase:<10} p50 {percentile(values, 50):.1f} ms")
+
+    print(f"📦 匯入時間（依套件加總 self time，前 {args.top} 名）")
+    for package, ms in imports_by_package(profiled["importtime"])[:args.top]:
+        print(f"  {package:<24}{ms:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
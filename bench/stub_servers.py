@@ -0,0 +1,166 @@
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 基準測試用的 OpenAI / LINE 替身：延遲、失敗率可調，並記錄每位使用者收到推播的時間
+
+
+class StubConfig:
+    def __init__(self, openai_latency=0.8, openai_jitter=0.2, openai_failure_rate=0.0, openai_failure_status=500,
+                 stream_chunks=20, answer_chars=400, line_latency=0.02, line_failure_rate=0.0,
+                 line_failure_status=500, seed=None):
+        self.openai_latency = openai_latency        # 回應（串流時為第一個 chunk）前的延遲，秒
+        self.openai_jitter = openai_jitter          # 延遲的隨機變動比例
+        self.openai_failure_rate = openai_failure_rate
+        self.openai_failure_status = openai_failure_status
+        self.stream_chunks = stream_chunks          # 串流回答分成幾個 chunk，chunk 間隔與 openai_latency 成比例
+        self.answer_chars = answer_chars
+        self.line_latency = line_latency
+        self.line_failure_rate = line_failure_rate
+        self.line_failure_status = line_failure_status
+        self.random = random.Random(seed)
+
+
+def _answer_text(chars):
+    paragraph = "依據規範，此項目須符合設計條件與施工要求，並於施工前完成確認。"
+    text = ""
+    while len(text) < chars:
+        text += paragraph + ("\n\n" if len(text) % 3 == 0 else "")
+    return text[:chars]
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # 用戶端關閉 keep-alive 連線屬正常情況，不印出 traceback
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        self.lock = threading.Lock()
+        self.pushes = {}  # {user_id: [time.monotonic(), ...]}
+        self.counts = {"chat": 0, "chat_failed": 0, "push": 0, "push_failed": 0, "reply": 0}
+        self.server = _QuietServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="bench-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.pushes.clear()
+            for key in self.counts:
+                self.counts[key] = 0
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _record_push(self, user_id, kind="push"):
+        with self.lock:
+            self.counts[kind] += 1
+            self.pushes.setdefault(user_id, []).append(time.monotonic())
+
+    def last_push_time(self):
+        with self.lock:
+            return max((times[-1] for times in self.pushes.values()), default=None)
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _fail(self, status):
+                headers = {"Retry-After": "1"} if status == 429 else None
+                self._send_json(status, {"error": {"message": "injected failure"}}, headers)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    self._chat(body)
+                elif self.path.startswith("/v2/bot/message/"):
+                    self._line(body)
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def _chat(self, body):
+                config = stub.config
+                stub._count("chat")
+                delay = config.openai_latency * (1 + config.random.uniform(-config.openai_jitter, config.openai_jitter))
+                if config.random.random() < config.openai_failure_rate:
+                    stub._count("chat_failed")
+                    time.sleep(delay / 4)
+                    return self._fail(config.openai_failure_status)
+
+                system = str(body.get("messages", [{}])[0].get("content", ""))
+                if "翻譯" in system:
+                    answer = "piping hydrostatic test pressure"
+                else:
+                    answer = _answer_text(config.answer_chars)
+
+                if not body.get("stream"):
+                    time.sleep(delay)
+                    return self._send_json(200, {"choices": [{"message": {"content": answer}}]})
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(delay)
+                size = max(1, len(answer) // config.stream_chunks)
+                pieces = [answer[i:i + size] for i in range(0, len(answer), size)]
+                for piece in pieces + [None]:
+                    data = "[DONE]" if piece is None else json.dumps({"choices": [{"delta": {"content": piece}}]})
+                    chunk = f"data: {data}\n\n".encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    self.wfile.flush()
+                    if piece is not None:
+                        time.sleep(delay / config.stream_chunks)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _line(self, body):
+                config = stub.config
+                time.sleep(config.line_latency)
+                if config.random.random() < config.line_failure_rate:
+                    stub._count("push_failed")
+                    return self._fail(config.line_failure_status)
+                if self.path.endswith("/push"):
+                    stub._record_push(body.get("to"))
+                elif self.path.endswith("/reply"):
+                    # 情境的 reply token 格式為 reply-<userId>，回覆也算成該使用者收到的推播
+                    stub._record_push(str(body.get("replyToken", "")).removeprefix("reply-"), "reply")
+                self._send_json(200, {})
+
+        return Handler
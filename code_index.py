@@ -0,0 +1,132 @@
+import re
+
+try:
+    from Levenshtein import distance as _levenshtein_distance
+except ImportError:  # 未安裝 python-Levenshtein 時使用下方的純 Python 版本
+    _levenshtein_distance = None
+
+# 代碼正規化：移除空白、連字號、底線並轉大寫；TYPE / M 系列數字部分補零到兩位
+_SEPARATOR_RE = re.compile(r"[\s\-_－]+")
+_PADDED_FAMILY_RE = re.compile(r"^(TYPE|TY|M)0*(\d{1,3})([A-Z]?)$")
+
+MAX_EDIT_DISTANCE = 2
+
+
+def canonical_code(code):
+    code = _SEPARATOR_RE.sub("", str(code)).upper()
+    match = _PADDED_FAMILY_RE.match(code)
+    if match:
+        prefix, number, suffix = match.groups()
+        prefix = "TYPE" if prefix.startswith("TY") else prefix
+        code = f"{prefix}{number.zfill(2)}{suffix}"
+    return code
+
+
+# 有上限的編輯距離：超過 max_distance 就提早放棄，回傳 max_distance + 1
+def bounded_edit_distance(a, b, max_distance=MAX_EDIT_DISTANCE):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if _levenshtein_distance is not None:
+        return min(_levenshtein_distance(a, b), max_distance + 1)
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+# 刪除 0~max_distance 個字元後的所有字串（SymSpell 作法），用來預先建立相近代碼的候選表
+def _deletes(code, max_distance):
+    variants = {code}
+    frontier = {code}
+    for _ in range(max_distance):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        variants |= frontier
+    return variants
+
+
+def _common_prefix_len(a, b):
+    length = 0
+    for char_a, char_b in zip(a, b):
+        if char_a != char_b:
+            break
+        length += 1
+    return length
+
+
+class _TrieNode:
+    __slots__ = ("children", "codes")
+
+    def __init__(self):
+        self.children = {}
+        self.codes = []  # 以此節點為前綴的所有原始代碼（依字母順序）
+
+
+# links.json 代碼索引：正規化後的精確查詢、前綴查詢與拼錯時的相近代碼建議
+class CodeIndex:
+    def __init__(self, links):
+        self.links = links
+        self.by_canonical = {}
+        self.deletes = {}  # {刪除字元後的字串: {canonical, ...}}，查詢時只需驗證少數候選
+        self.trie = _TrieNode()
+        for code in sorted(links):
+            canonical = canonical_code(code)
+            self.by_canonical.setdefault(canonical, code)
+            for variant in _deletes(canonical, MAX_EDIT_DISTANCE):
+                self.deletes.setdefault(variant, set()).add(canonical)
+            node = self.trie
+            for char in canonical:
+                node = node.children.setdefault(char, _TrieNode())
+                node.codes.append(code)
+
+    def __len__(self):
+        return len(self.links)
+
+    # 回傳 (原始代碼, 連結)；找不到時回傳 None
+    def lookup(self, query):
+        code = self.by_canonical.get(canonical_code(query))
+        return (code, self.links[code]) if code else None
+
+    # 以 prefix 開頭的代碼（例如 A14 → A142N、A1427…）
+    def starting_with(self, prefix, limit=10):
+        node = self.trie
+        for char in canonical_code(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.codes[:limit]
+
+    # 編輯距離在 MAX_EDIT_DISTANCE 以內的相近代碼，距離近、共同前綴長的排前面
+    def similar(self, query, limit=4):
+        canonical = canonical_code(query)
+        candidates = set()
+        for variant in _deletes(canonical, MAX_EDIT_DISTANCE):
+            candidates |= self.deletes.get(variant, set())
+
+        scored = []
+        for candidate in candidates:
+            distance = bounded_edit_distance(canonical, candidate)
+            if 0 < distance <= MAX_EDIT_DISTANCE:
+                scored.append((distance, -_common_prefix_len(canonical, candidate), candidate))
+        scored.sort()
+        return [self.by_canonical[candidate] for _, _, candidate in scored[:limit]]
+
+    # 找不到時給使用者的建議：先列以輸入為開頭的代碼，不足再補編輯距離相近的代碼
+    def suggest(self, query, limit=4):
+        suggestions = [code for code in self.starting_with(query, limit) if canonical_code(code) != canonical_code(query)]
+        for code in self.similar(query, limit):
+            if len(suggestions) >= limit:
+                break
+            if code not in suggestions:
+                suggestions.append(code)
+        return suggestions[:limit]
@@ -0,0 +1,34 @@
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# Dialogflow 的 webhook 約 5 秒逾時，預留網路與序列化時間後的處理預算
+DEFAULT_BUDGET_SECONDS = 4.0
+
+
+# 單次請求的時間預算：從建立時開始計時
+class Deadline:
+    __slots__ = ("started_at", "budget")
+
+    def __init__(self, budget=DEFAULT_BUDGET_SECONDS):
+        self.started_at = time.monotonic()
+        self.budget = budget
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def remaining(self):
+        return max(0.0, self.budget - self.elapsed())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+# 在期限內等待背景工作的結果；逾時回傳 (False, None)，工作會在背景繼續執行，
+# 若有提供 on_late 則在工作完成時以 future 呼叫它
+def wait_within(deadline, future, on_late=None):
+    try:
+        return True, future.result(timeout=deadline.remaining())
+    except FutureTimeout:
+        if on_late is not None:
+            future.add_done_callback(on_late)
+        return False, None
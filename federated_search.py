@@ -0,0 +1,110 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from spec_index import normalize_text
+
+# 問題中可能是代碼的字詞；前後接英數字或「.數字」的不算（例如 B16.5、ASME B16.11 是標準編號）
+_CODE_TOKEN_RE = re.compile(r"(?<![A-Z0-9.])[A-Z]{1,4}[-\s]?\d{1,4}[A-Z0-9]*(?![A-Z0-9]|\.\d)")
+
+# 一般查詢只列出完全相符的代碼；以輸入為開頭或編輯距離相近的代碼只在明確查詢代碼卻找不到時
+# 當作建議（CodeIndex.suggest），否則「A106 碳鋼」、「B16.5 法蘭」這類材料規格或標準編號會帶出無關的下載連結
+CODE_EXACT_SCORE = 100
+
+
+class CodeEntry:
+    __slots__ = ("code", "url", "label", "text")
+
+    def __init__(self, code, url):
+        self.code = code
+        self.url = url
+        self.label = f"{code} 下載連結"
+        self.text = f"🔗 {code} 的下載連結：\n{url}"
+
+
+# 把 links.json 的代碼索引包成與 SpecIndex 相同的介面（name / search / get / ref），可以一起排名與翻頁
+class CodeSource:
+    def __init__(self, code_index, name="type_links"):
+        self.code_index = code_index
+        self.name = name
+
+    def __len__(self):
+        return len(self.code_index)
+
+    def get(self, chapter, section):
+        url = self.code_index.links.get(section)
+        return CodeEntry(section, url) if chapter == "code" and url else None
+
+    def ref(self, entry):
+        return f"{self.name}|code|{entry.code}"
+
+    def search(self, query, top_k=None, threshold=70):
+        scored = {}
+        for token in _CODE_TOKEN_RE.findall(query.upper()):
+            found = self.code_index.lookup(token)
+            if found:
+                scored[found[0]] = CODE_EXACT_SCORE
+        ranked = sorted(scored.items(), key=lambda item: (-item[1], item[0]))
+        hits = [(score, CodeEntry(code, self.code_index.links[code])) for code, score in ranked if score >= threshold]
+        return hits[:top_k] if top_k else hits
+
+
+class FederatedHit:
+    __slots__ = ("entry", "source", "label")
+
+    def __init__(self, entry, source, tag):
+        self.entry = entry
+        self.source = source
+        self.label = f"【{tag}】{entry.label}"
+
+    @property
+    def text(self):
+        return self.entry.text
+
+
+# 同時查詢多個本地語料（共同規範、熱處理規範、代碼索引），分數各自換算到 0~1 後合併排名、去除重複內容；
+# 參照（ref）沿用各語料自己的格式，選擇項目時由 resolve_ref 直接回到原本的語料
+class FederatedSearch:
+    # executor 可由外部傳入，重新載入規範時新舊索引共用同一組執行緒
+    def __init__(self, sources, name="federated", max_workers=1, executor=None):
+        self.sources = sources  # [(index, 來源標籤)]，排序也是同分時的優先順序
+        self.name = name
+        self.max_workers = max_workers
+        if executor is None and max_workers > 1:
+            executor = ThreadPoolExecutor(max_workers, thread_name_prefix="federated")
+        self._executor = executor
+
+    def __len__(self):
+        return sum(len(index) for index, _ in self.sources)
+
+    def get(self, chapter, section):
+        return None
+
+    def ref(self, hit):
+        return hit.source.ref(hit.entry)
+
+    def search(self, query, top_k=None, threshold=70):
+        if self._executor is not None:
+            futures = [self._executor.submit(index.search, query, top_k, threshold) for index, _ in self.sources]
+            results = [future.result() for future in futures]
+        else:
+            results = [index.search(query, top_k=top_k, threshold=threshold) for index, _ in self.sources]
+
+        merged = []
+        for priority, ((index, tag), hits) in enumerate(zip(self.sources, results)):
+            for order, (score, entry) in enumerate(hits):
+                # 各語料的分數門檻不同，換算成門檻以上的相對位置（0~1）後才能互相比較
+                normalized = max(0.0, min(1.0, (score - threshold) / (100 - threshold)))
+                merged.append((-normalized, priority, order, FederatedHit(entry, index, tag)))
+        merged.sort(key=lambda item: item[:3])
+
+        seen = set()
+        ranked = []
+        for negative_score, _, _, hit in merged:
+            key = normalize_text(hit.text)
+            if key in seen:
+                continue
+            seen.add(key)
+            ranked.append((-negative_score, hit))
+            if top_k and len(ranked) >= top_k:
+                break
+        return ranked
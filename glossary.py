@@ -0,0 +1,201 @@
+import re
+import unicodedata
+
+# 配管／熱處理常用詞彙中英對照：查詢由這些詞組成時，直接在本地轉成英文查詢，不必呼叫 GPT 翻譯
+GLOSSARY = {
+    # 熱處理
+    "熱處理": "heat treatment",
+    "焊後熱處理": "postweld heat treatment",
+    "銲後熱處理": "postweld heat treatment",
+    "應力消除": "stress relieve",
+    "預熱": "preheat",
+    "預熱溫度": "preheating temperature",
+    "層間溫度": "interpass temperature",
+    "道間溫度": "interpass temperature",
+    "後熱": "postheating",
+    "保溫時間": "holding time",
+    "持溫時間": "holding time",
+    "保持時間": "holding time",
+    "持溫溫度": "holding temperature",
+    "保溫溫度": "holding temperature",
+    "升溫速率": "rate of heating",
+    "加熱速率": "rate of heating",
+    "降溫速率": "cooling",
+    "冷卻速率": "cooling",
+    "冷卻": "cooling",
+    "緩慢冷卻": "cooled gradually",
+    "加熱寬度": "heated circumferential band",
+    "加熱帶": "heated circumferential band",
+    "保溫寬度": "width to be insulated",
+    "局部熱處理": "local heat treatments",
+    "爐內熱處理": "furnace heat treatment",
+    "加熱爐": "furnace",
+    "爐": "furnace",
+    "熱電偶": "thermocouple",
+    "溫度計": "thermometers",
+    "溫度控制": "temperature control",
+    "電阻加熱": "electrical resistance",
+    "感應加熱": "electric inductance",
+    "加熱線圈": "heating coil",
+    "瓦斯燒嘴": "gas burner",
+    "燃燒器": "gas burner",
+    "溫度筆": "tempil stick",
+    "硬度": "hardness",
+    "硬度試驗": "hardness test",
+    "硬度測試": "hardness test",
+    "紀錄": "recorded",
+    "記錄": "recorded",
+    # 材料
+    "碳鋼": "carbon steel",
+    "合金鋼": "alloy steel",
+    "低合金鋼": "low-alloy steels",
+    "不銹鋼": "stainless steel",
+    "不鏽鋼": "stainless steel",
+    "異種金屬": "dissimilar metals",
+    "異材": "dissimilar metals",
+    "含碳量": "carbon content",
+    "碳含量": "carbon content",
+    "焊條": "welding rods",
+    "銲條": "welding rods",
+    "材料": "materials",
+    "材質": "materials",
+    "非鐵金屬": "non-ferrous",
+    # 焊接
+    "焊接": "welding",
+    "銲接": "welding",
+    "焊道": "welds",
+    "銲道": "welds",
+    "焊口": "welds",
+    "對焊": "butt welds",
+    "對接焊": "butt welds",
+    "填角焊": "fillet welds",
+    "角焊": "fillet welds",
+    "承插焊": "socket welds",
+    "補焊": "repair welds",
+    "修補": "repairs",
+    "點焊": "tack welds",
+    "密封焊": "seal welds",
+    "重新焊接": "rewelding",
+    "焊接程序": "welding procedure specification",
+    "銲接程序": "welding procedure specification",
+    "氣割": "gas cutting",
+    "切割": "cutting",
+    "拘束": "restraint",
+    "全周焊": "weld-all-around",
+    # 配管
+    "配管": "piping",
+    "管線": "piping",
+    "管子": "pipes",
+    "管": "pipe",
+    "支管": "branch connections",
+    "分支": "branch connections",
+    "管托": "pipe shoe",
+    "管鞋": "pipe shoe",
+    "管支撐": "pipe supports",
+    "支撐": "supports",
+    "支架": "supports",
+    "閥": "valves",
+    "閥門": "valves",
+    "儀器": "instruments",
+    "厚度": "thickness",
+    "壁厚": "wall thickness",
+    "管徑": "NPS",
+    "溫度": "temperature",
+    "溫度範圍": "temperature range",
+    "時間": "time",
+    "分鐘": "minutes",
+    "變形": "distortion",
+    "氧化": "oxidation",
+    "加工面": "machined surfaces",
+    "保護": "protected",
+    "保溫": "insulation",
+    "保溫材": "insulation",
+    "檢驗": "examination",
+    "檢查": "inspection",
+    "適用範圍": "scope",
+    "範圍": "scope",
+    "參考規範": "references",
+    "一般要求": "general requirements",
+    "附錄": "appendix",
+    "安裝": "installation",
+    "位置": "location",
+}
+
+# 查詢中常見、不影響檢索的字詞（疑問詞、語助詞等）
+STOPWORDS = {
+    "的", "是", "嗎", "呢", "吧", "了", "和", "與", "及", "或", "在", "要", "需", "需要", "須", "必須",
+    "多少", "幾", "幾度", "什麼", "甚麼", "怎麼", "如何", "哪些", "哪個", "哪裡", "為何", "為什麼", "有", "沒有", "請問", "請",
+    "問", "查", "查詢", "我想", "想", "知道", "規定", "規範", "標準", "要求", "相關", "有關", "關於",
+    "做", "進行", "執行", "施作", "應", "該", "可以", "可", "是否", "多久", "多長", "多高", "以上", "以下",
+    "度", "時", "後", "前", "中", "對", "於", "用", "使用", "一下", "內容", "方式", "方法", "條件", "一般",
+}
+
+MAX_UNKNOWN_RATIO = 0.25  # 無法辨識的中文字超過這個比例，就交給 GPT 翻譯
+
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_LATIN_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9.\-/%]*")
+_MAX_TERM_LEN = max(len(term) for term in list(GLOSSARY) + list(STOPWORDS))
+
+
+class Expansion:
+    __slots__ = ("english", "terms", "bilingual", "variants")
+
+    def __init__(self, english, terms, bilingual, variants):
+        self.english = english      # 整句的英文查詢
+        self.terms = terms          # [(中文詞, 英文詞)]
+        self.bilingual = bilingual  # 中英並列，方便紀錄與除錯
+        self.variants = variants    # 依序用來查詢的英文查詢字串
+
+
+def _longest_match(text, start, vocabulary):
+    for length in range(min(_MAX_TERM_LEN, len(text) - start), 0, -1):
+        if text[start:start + length] in vocabulary:
+            return text[start:start + length]
+    return None
+
+
+# 以最長詞優先切詞，把查詢轉成英文；無法辨識的中文字太多時回傳 None，交給 GPT 翻譯
+def expand(query):
+    text = unicodedata.normalize("NFKC", query or "")
+    parts = []     # 依原順序的英文詞與原本就是英數的字
+    terms = []
+    cjk_count = 0
+    unknown = 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if _CJK_RE.match(char):
+            term = _longest_match(text, i, GLOSSARY)
+            stopword = _longest_match(text, i, STOPWORDS)
+            # 詞彙與虛詞都能比對時取較長者，例如「需要」不該被切成「需」＋「要」
+            if term and (not stopword or len(term) >= len(stopword)):
+                terms.append((term, GLOSSARY[term]))
+                parts.append(GLOSSARY[term])
+                cjk_count += len(term)
+                i += len(term)
+            elif stopword:
+                cjk_count += len(stopword)
+                i += len(stopword)
+            else:
+                cjk_count += 1
+                unknown += 1
+                i += 1
+            continue
+        match = _LATIN_RE.match(text, i)
+        if match:
+            parts.append(match.group(0))
+            i = match.end()
+        else:
+            i += 1
+
+    if not terms or unknown > cjk_count * MAX_UNKNOWN_RATIO:
+        return None
+
+    english = " ".join(dict.fromkeys(parts))
+    # 先查整句，再以單一詞補強（長的詞較具體，排前面）
+    variants = [english]
+    for _, en in sorted(terms, key=lambda item: -len(item[1])):
+        if en not in variants:
+            variants.append(en)
+    bilingual = " ".join(f"{zh}({en})" for zh, en in terms)
+    return Expansion(english, terms, bilingual, variants)
@@ -0,0 +1,33 @@
+import gc
+import multiprocessing
+import os
+
+# 正式環境的 gunicorn 設定：python webhook.py 只適合本機開發
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# 每個 CPU 核心一個 worker process，每個 worker 內再用執行緒處理多個請求
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# 在 master 先載入規範資料與索引，fork 後 worker 以 copy-on-write 共用
+preload_app = True
+
+# Dialogflow webhook 本身約 5 秒逾時，這裡的 timeout 只是保護卡住的 worker
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+# 關閉時保留時間讓背景 GPT 工作完成並推播
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 90))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+# 多個 worker 時對話歷史需共用，預設改用本機 SQLite
+if workers > 1:
+    os.environ.setdefault("SESSION_STORE", "sqlite")
+
+
+def when_ready(server):
+    # 預先載入的物件移出 GC 追蹤，避免 fork 後 GC 掃描造成大量分頁被複製
+    gc.freeze()
+    server.log.info("spec data preloaded, forking %s workers x %s threads", workers, threads)
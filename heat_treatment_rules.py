@@ -0,0 +1,249 @@
+import re
+
+# 熱處理規則表：把 piping_heat_treatment.json 中可量化的規定整理成結構化資料，數值查詢不必經過模糊比對或 GPT。
+# 規範 4.1.1 / 6.1.1 指向的 Appendix 1（預熱）與 Appendix 2（PWHT）未收錄在 JSON 中，
+# 這兩部分改用 ASME B31.3（2016 版起）Table 330.1.1 與 Table 331.1.1 的數值，回覆時一併註明出處。
+SPEC_NAME = "熱處理規範"
+B31_3_PREHEAT = "ASME B31.3 Table 330.1.1"
+B31_3_PWHT = "ASME B31.3 Table 331.1.1"
+PENDING_APPENDIX_NOTE = "規範 Appendix 1 / Appendix 2 未收錄於資料庫，以上數值依 ASME B31.3，實際請以規範附錄為準。"
+
+CARBON_PREHEAT_LIMIT_PCT = 0.30  # 4.1.2
+CARBON_PREHEAT_MIN_C = 80
+
+# 預熱下限（°C）：(P-No., 厚度上限 mm（不含上限值，None 表示不限）, SMTS 上限 MPa（None 表示不限）, 最低預熱溫度)，依序取第一個符合的
+# 不知道 SMTS 時略過有 SMTS 上限的列，改用較高的預熱溫度
+PREHEAT_TABLE = [
+    ("1", 25, 490, 10),
+    ("1", None, None, 79),
+    ("3", 13, 490, 10),
+    ("3", None, None, 79),
+    ("4", None, None, 121),
+    ("5A", None, 414, 149),
+    ("5A", None, None, 204),
+    ("5B", None, 414, 149),
+    ("5B", None, None, 204),
+    ("15E", None, None, 204),
+    ("6", None, None, 204),
+    ("7", None, None, 10),
+    ("8", None, None, 10),
+]
+
+# PWHT：P-No. → (免除的厚度上限 mm, 溫度範圍 °C, 每 25 mm 保溫時數, 最少保溫時數, 免除條件說明)
+PWHT_TABLE = {
+    "1": (19, (595, 650), 1, 1, None),
+    "3": (19, (595, 650), 1, 1, None),
+    "4": (13, (650, 705), 1, 2, "厚度 ≤ 13 mm 且預熱 ≥ 120°C、規定最大含碳量 ≤ 0.15% 時可免除"),
+    "5A": (13, (675, 760), 1, 2, "厚度 ≤ 13 mm 且預熱 ≥ 175°C、規定最大含碳量 ≤ 0.15% 時可免除"),
+    "5B": (0, (705, 770), 1, 2, None),
+    "15E": (0, (705, 770), 1, 2, None),
+    "8": (None, None, 0, 0, None),
+}
+PWHT_EXEMPT_CARBON_PCT = 0.15
+
+# 預熱與 PWHT 表都有的 P-Number 才由規則表回答，其他（如 6、7、9A）回覆會缺項，改查規範
+SUPPORTED_P_NUMBERS = {row[0] for row in PREHEAT_TABLE} & set(PWHT_TABLE)
+
+# 5.0 POSTHEATING：P-No.4 超過 NPS 6" 或厚度超過 10 mm，以及 P-No.5 材料，300~400°C 保持 30 分鐘以上
+# 規範的 P-No.5 包含舊版 P-No.5B 的 P91，因此 P-No.15E 一併適用
+POSTHEAT_RANGE_C = (300, 400)
+POSTHEAT_MIN_MINUTES = 30
+
+# 材質名稱對應 (P-Number, SMTS MPa)，依序取第一個符合的；SMTS 取該材質常用等級（A106 Gr.B、A335 P22 等）的值
+# P91（9Cr-1Mo-V）自 B31.3 2016 版起為 P-No.15E，須排在 9Cr（P9，P-No.5B）之前
+MATERIAL_P_NUMBERS = [
+    (re.compile(r"P\s*91|T\s*91|GR(?:ADE)?\.?\s*91|9\s*CR\s*-?\s*1\s*MO\s*-?\s*V", re.I), "15E", 585),
+    (re.compile(r"(?<![\d./])9\s*CR|P\s*9\b|(?<![\d./])9\s*鉻", re.I), "5B", 415),
+    (re.compile(r"(?:2\s*-?\s*1/4|(?<![\d./])2\.25|(?<![\d./])5)\s*CR|P\s*22\b|P\s*5\b", re.I), "5A", 415),
+    (re.compile(r"(?:1\s*-?\s*1/4|1\.25)\s*CR|P\s*11|1/2\s*MO|0\.5\s*MO|C\s*-\s*1/2\s*MO", re.I), "4", 415),
+    (re.compile(r"不銹鋼|不鏽鋼|STAINLESS|\bSUS|\bSS\s*3\d\d", re.I), "8", 515),
+    (re.compile(r"碳鋼|CARBON\s*STEEL|\bCS\b|A\s*106|A\s*53\b|A\s*333", re.I), "1", 415),
+]
+
+_P_NUMBER_RE = re.compile(r"P\s*(?:[-－]\s*NO\.?|NO\.?|NUMBER|#|[-－])\s*(\d{1,2}[A-F]?)(?![\d.A-Z])", re.I)
+_THICKNESS_RE = re.compile(r"(?:厚度?|T\s*=|THK\.?|THICKNESS)?\s*(\d+(?:\.\d+)?)\s*(?:MM|毫米|公釐|ｍｍ)", re.I)
+# 管徑：整數、小數或分數（3/4、1-1/2、1 1/2）；後面接 mm 的數字是厚度，不當作管徑
+_NPS_NUMBER = r"(?<![\d./-])(\d+\s*-\s*\d+/\d+|\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)"
+_MM_UNIT = r"MM|毫米|公釐|ｍｍ"
+_NPS_RE = re.compile(
+    rf"(?:NPS|管徑|口徑)\s*{_NPS_NUMBER}(?![\d./]|\s*(?:{_MM_UNIT}))|{_NPS_NUMBER}\s*(?:\"|”|吋|英吋|INCH|IN\b)", re.I
+)
+_CARBON_RE = re.compile(r"(?:含碳量|碳含量|CARBON|\bC)\s*(?:[:：=>＞≥]|大於|超過)?\s*(\d?\.\d+)\s*%", re.I)
+# 只有問到預熱、後熱或 PWHT 時才由規則表回答，其他熱處理問題（例如硬度試驗）交給規範搜尋
+_TOPIC_RE = re.compile(r"預熱|後熱|PWHT|P\.W\.H\.T|PRE\s*-?\s*HEAT|POST\s*-?\s*HEAT|應力消除|消除應力|保溫時間|持溫", re.I)
+_RESTRAINT_RE = re.compile(r"拘束|全周焊|PIPE\s*SHOE|管鞋|SHOE|RESTRAINT", re.I)
+
+
+def normalize_p_number(p_number):
+    p_number = re.sub(r"\s+", "", str(p_number)).upper()
+    # 未標示群組的 P-No.5 視為 5A（2-1/4Cr、5Cr）
+    return "5A" if p_number == "5" else p_number
+
+
+def preheat(p_number, thickness_mm=None, carbon_pct=None, high_restraint=False, smts_mpa=None):
+    p_number = normalize_p_number(p_number)
+    result = None
+    skipped_smts = None  # 因不知道 SMTS 而略過的 SMTS 上限
+    for p, max_thickness, max_smts, min_c in PREHEAT_TABLE:
+        if p != p_number:
+            continue
+        if max_thickness is not None and (thickness_mm is None or thickness_mm >= max_thickness):
+            continue
+        if max_smts is not None and (smts_mpa is None or smts_mpa > max_smts):
+            if smts_mpa is None:
+                skipped_smts = max_smts
+            continue
+        result = {"min_c": min_c, "source": B31_3_PREHEAT}
+        if skipped_smts:
+            result["note"] = f"未提供材質，無法確認 SMTS ≤ {skipped_smts} MPa，以較高的預熱溫度回覆"
+        break
+    # 4.1.2：碳鋼規定最大含碳量超過 0.30% 或高拘束（如 pipe shoe 全周焊），至少預熱 80°C
+    if p_number == "1" and ((carbon_pct is not None and carbon_pct > CARBON_PREHEAT_LIMIT_PCT) or high_restraint):
+        if result is None or result["min_c"] < CARBON_PREHEAT_MIN_C:
+            result = {"min_c": CARBON_PREHEAT_MIN_C, "source": f"{SPEC_NAME} 4.1.2"}
+    return result
+
+
+def postheat(p_number, thickness_mm=None, nps=None):
+    p_number = normalize_p_number(p_number)
+    required = p_number in ("5A", "5B", "15E") or (
+        p_number == "4" and ((nps is not None and nps > 6) or (thickness_mm is not None and thickness_mm > 10))
+    )
+    # P-No.4 厚度未超過 10 mm 時取決於管徑，問題沒有提供管徑就不能斷定不需要
+    unknown_nps = not required and p_number == "4" and nps is None
+    if not required and not unknown_nps:
+        return None
+    return {
+        "range_c": POSTHEAT_RANGE_C,
+        "min_minutes": POSTHEAT_MIN_MINUTES,
+        "source": f"{SPEC_NAME} 5.0",
+        "note": "焊後立即進行 PWHT 時可免除後熱；後熱後須以保溫材料緩慢冷卻。",
+        "condition": "未提供管徑，超過 NPS 6\" 時需要" if unknown_nps else None,
+    }
+
+
+def pwht(p_number, thickness_mm, carbon_pct=None):
+    p_number = normalize_p_number(p_number)
+    rule = PWHT_TABLE.get(p_number)
+    if rule is None:
+        return None
+    exempt_max, temp_range, hours_per_25mm, min_hours, condition = rule
+    if temp_range is None:
+        return {"required": False, "source": B31_3_PWHT, "condition": None}
+    within_exempt_thickness = bool(exempt_max) and thickness_mm <= exempt_max
+    if within_exempt_thickness and (
+            condition is None or (carbon_pct is not None and carbon_pct <= PWHT_EXEMPT_CARBON_PCT)):
+        return {"required": False, "source": B31_3_PWHT, "condition": condition}
+    hours = max(min_hours, hours_per_25mm * thickness_mm / 25)
+    return {
+        "required": True,
+        "range_c": temp_range,
+        "holding_hours": round(hours, 2),
+        "holding_rule": f"每 25 mm {hours_per_25mm} 小時，最少 {min_hours} 小時",
+        "source": f"{SPEC_NAME} 6.1.1 / {B31_3_PWHT}",
+        # 免除條件取決於含碳量，但問題沒有提供：仍列為需要，並說明符合條件時可免除
+        "unless": condition if within_exempt_thickness and carbon_pct is None else None,
+    }
+
+
+# 依 P-Number、厚度、管徑與含碳量查出預熱、後熱與 PWHT 要求
+def lookup(p_number, thickness_mm, nps=None, carbon_pct=None, high_restraint=False, smts_mpa=None):
+    p_number = normalize_p_number(p_number)
+    return {
+        "p_number": p_number,
+        "thickness_mm": thickness_mm,
+        "nps": nps,
+        "carbon_pct": carbon_pct,
+        "preheat": preheat(p_number, thickness_mm, carbon_pct, high_restraint, smts_mpa),
+        # 4.1.4：預熱加熱帶寬度為 4 倍管壁厚或 100 mm 取大者（焊道兩側）
+        "preheat_band_mm": max(4 * thickness_mm, 100) if thickness_mm is not None else None,
+        "postheat": postheat(p_number, thickness_mm, nps),
+        "pwht": pwht(p_number, thickness_mm, carbon_pct) if thickness_mm is not None else None,
+    }
+
+
+# 從問題中取出查詢參數；找不到 P-Number（或可對應的材質）與厚度時回傳 None
+def _parse_fraction(text):
+    whole, _, fraction = re.sub(r"\s*-\s*|\s+", " ", text.strip()).rpartition(" ")
+    if "/" in fraction:
+        numerator, denominator = fraction.split("/")
+        if not int(denominator):
+            return None
+        return (float(whole) if whole else 0) + int(numerator) / int(denominator)
+    return float(text)
+
+
+# 問題中的管徑（NPS 吋）；沒有提到或出現兩個不同的管徑時回傳 None
+def parse_nps(question):
+    values = {_parse_fraction(match.group(1) or match.group(2)) for match in _NPS_RE.finditer(question)}
+    values.discard(None)
+    return values.pop() if len(values) == 1 else None
+
+
+def parse_query(question):
+    material = next(((p, smts) for pattern, p, smts in MATERIAL_P_NUMBERS if pattern.search(question)), None)
+    match = _P_NUMBER_RE.search(question)
+    p_number = normalize_p_number(match.group(1)) if match else (material[0] if material else None)
+    thickness = _THICKNESS_RE.search(question)
+    if p_number is None or thickness is None:
+        return None
+    carbon = _CARBON_RE.search(question)
+    return {
+        "p_number": p_number,
+        "thickness_mm": float(thickness.group(1)),
+        "nps": parse_nps(question),
+        "carbon_pct": float(carbon.group(1)) if carbon else None,
+        "high_restraint": bool(_RESTRAINT_RE.search(question)),
+        # 只有材質與 P-Number 一致時才採用該材質的 SMTS
+        "smts_mpa": material[1] if material and material[0] == p_number else None,
+    }
+
+
+def _format_number(value):
+    return f"{value:g}"
+
+
+def format_result(result):
+    lines = [f"🔥 P-No.{result['p_number']}，厚度 {_format_number(result['thickness_mm'])} mm"
+             + (f"，NPS {_format_number(result['nps'])}\"" if result["nps"] is not None else "")
+             + (f"，含碳量 {_format_number(result['carbon_pct'])}%" if result["carbon_pct"] is not None else "")]
+
+    heat = result["preheat"]
+    if heat:
+        lines.append(f"• 預熱：最低 {heat['min_c']}°C（{heat['source']}）")
+        if heat.get("note"):
+            lines.append(f"  {heat['note']}")
+        lines.append(f"  加熱帶寬度：焊道兩側各 {_format_number(result['preheat_band_mm'])} mm（{SPEC_NAME} 4.1.4）")
+    post = result["postheat"]
+    if post:
+        low, high = post["range_c"]
+        condition = f"{post['condition']}：" if post["condition"] else ""
+        lines.append(f"• 後熱：{condition}{low}~{high}°C 保持 {post['min_minutes']} 分鐘以上（{post['source']}）\n  {post['note']}")
+    else:
+        lines.append(f"• 後熱：不需要（{SPEC_NAME} 5.0）")
+    treatment = result["pwht"]
+    if treatment and treatment["required"]:
+        low, high = treatment["range_c"]
+        lines.append(
+            f"• PWHT：{low}~{high}°C，保溫 {_format_number(treatment['holding_hours'])} 小時"
+            f"（{treatment['holding_rule']}；{treatment['source']}）"
+        )
+        if treatment.get("unless"):
+            lines.append(f"  未提供含碳量，無法判定可否免除：{treatment['unless']}，請提供規定最大含碳量")
+    elif treatment:
+        condition = f"；{treatment['condition']}" if treatment.get("condition") else ""
+        lines.append(f"• PWHT：不需要（{treatment['source']}{condition}）")
+
+    lines.append(f"\n⚠️ {PENDING_APPENDIX_NOTE}")
+    return "\n".join(lines)
+
+
+# 熱處理模式的數值問題：問到預熱、後熱或 PWHT，且解析得出規則表涵蓋的 P-Number 與厚度時直接回覆；
+# 否則回傳 None 交給規範文字搜尋
+def answer(question):
+    if not _TOPIC_RE.search(question):
+        return None
+    params = parse_query(question)
+    if params is None or params["p_number"] not in SUPPORTED_P_NUMBERS:
+        return None
+    return format_result(lookup(**params))
@@ -0,0 +1,132 @@
+import math
+import re
+
+import metrics
+from http_client import chat_completion
+
+# 對話歷史 token 預算：最近幾輪原文保留，較早的對話濃縮成一段滾動摘要
+SUMMARY_PREFIX = "【先前對話摘要】"
+SUMMARY_PROMPT = (
+    "你是配管設計專家的助理，請將以下對話整理成簡短的重點摘要（條列式，不超過 {limit} 字），"
+    "保留使用者的需求、提到的管線等級、規範條文、數值與已得出的結論，省略寒暄與重複內容。"
+)
+MESSAGE_OVERHEAD_TOKENS = 4  # 每則訊息的角色、分隔符號等額外 token
+
+# 中日韓文字與全形標點約一字一個 token，其餘文字約四個字元一個 token
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_encoding = None
+_encoding_loaded = False
+
+
+# tiktoken 為選用套件：有安裝就用實際的 tokenizer，否則使用上方的估算
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def message_text(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def message_tokens(message):
+    return count_tokens(message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+
+
+def is_summary(message):
+    return message.get("role") == "system" and message_text(message).startswith(SUMMARY_PREFIX)
+
+
+def summarize_turns(previous_summary, messages, limit_chars):
+    transcript = "\n".join(
+        f"{'使用者' if message['role'] == 'user' else '助理'}：{message_text(message)}" for message in messages
+    )
+    if previous_summary:
+        transcript = f"先前摘要：\n{previous_summary}\n\n後續對話：\n{transcript}"
+    with metrics.stage_timer("history_summary"):
+        return chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(limit=limit_chars)},
+                {"role": "user", "content": transcript}
+            ],
+            max_tokens=400,
+            temperature=0.2
+        )
+
+
+# 對話歷史管理：列表開頭可能有一則摘要（system 訊息），後面是原文保留的最近對話
+class HistoryManager:
+    def __init__(self, budget_tokens=1500, summary_tokens=300, summarize=summarize_turns):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize
+
+    @staticmethod
+    def split(history):
+        if history and is_summary(history[0]):
+            return message_text(history[0])[len(SUMMARY_PREFIX):], history[1:]
+        return None, list(history)
+
+    @staticmethod
+    def join(summary, turns):
+        if not summary:
+            return list(turns)
+        return [{"role": "system", "content": SUMMARY_PREFIX + summary}] + list(turns)
+
+    def total_tokens(self, history):
+        return sum(message_tokens(message) for message in history)
+
+    # 從最新的訊息往回保留，直到用完 budget；回傳 (較早的訊息, 保留的訊息)，至少保留最後一則
+    @staticmethod
+    def _partition(turns, budget):
+        used = 0
+        start = len(turns)
+        while start > 0:
+            cost = message_tokens(turns[start - 1])
+            if used + cost > budget and start < len(turns):
+                break
+            used += cost
+            start -= 1
+        return turns[:start], turns[start:]
+
+    # 不呼叫 GPT 的快速上限：超過 budget 兩倍時直接捨棄最舊的原文（請求路徑上使用）
+    def trim(self, history):
+        if self.total_tokens(history) <= self.budget_tokens * 2:
+            return list(history)
+        summary, turns = self.split(history)
+        _, recent = self._partition(turns, self.budget_tokens * 2 - self.summary_tokens)
+        return self.join(summary, recent)
+
+    # 超過 budget 時把較早的對話併入摘要（會呼叫 GPT，在背景工作中使用）；摘要失敗時退回 trim 的做法
+    def compact(self, history):
+        if self.total_tokens(history) <= self.budget_tokens:
+            return list(history)
+        summary, turns = self.split(history)
+        older, recent = self._partition(turns, self.budget_tokens - self.summary_tokens)
+        if not older:
+            return self.join(summary, recent)
+        try:
+            summary = self.summarize(summary, older, self.summary_tokens)
+            print(f"🗜️ 將 {len(older)} 則較早的對話併入摘要")
+        except Exception as e:
+            print("❌ 對話摘要失敗，捨棄較早的對話:", e)
+        return self.join(summary, recent)
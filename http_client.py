@@ -0,0 +1,154 @@
+import json
+import os
+import uuid
+from threading import Lock
+
+import metrics
+
+# 共用的 HTTP 連線層：OpenAI 與 LINE 都走同一組 keep-alive 連線池，並統一 timeout 與重試策略（LINE 的狀態碼重試見 line_delivery）
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me").rstrip("/")
+
+# 連線池大小預設為 GPT 工作數再多留幾條給請求執行緒
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", int(os.getenv("GPT_WORKERS", 8)) + 4))
+# (連線 timeout, 讀取 timeout)，單位秒
+OPENAI_TIMEOUT = (float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5)), float(os.getenv("OPENAI_READ_TIMEOUT", 60)))
+LINE_TIMEOUT = (float(os.getenv("LINE_CONNECT_TIMEOUT", 5)), float(os.getenv("LINE_READ_TIMEOUT", 10)))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 2))
+
+_session = None
+_session_lock = Lock()
+
+
+# requests / urllib3 匯入約需 30 ms，等第一次呼叫外部服務時才載入，縮短冷啟動到第一個回應的時間
+def _build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,  # 讀取逾時不重試，避免同一個 GPT 請求重複計費
+        status=MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    # LINE 只在連線失敗時重試；429 / 5xx 由 line_delivery 依 Retry-After 退避，避免兩層重試疊加
+    line_retry = Retry(total=MAX_RETRIES, connect=MAX_RETRIES, read=0, status=0, backoff_factor=0.5,
+                       allowed_methods=frozenset(["POST"]), respect_retry_after_header=False, raise_on_status=False)
+    line_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=line_retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # requests 依最長的前綴選擇 adapter；掛在 /v2/bot/ 底下，替身伺服器與 OpenAI 共用網址時也不會混用
+    session.mount(f"{LINE_API_BASE}/v2/bot/", line_adapter)
+    return session
+
+
+# 第一次使用時才建立連線池（也讓多 process 部署時每個 worker 各自擁有連線）
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+# 送出 POST 並記錄外部服務的錯誤次數（重試後仍失敗的狀態碼，或連線、逾時等例外）
+def _post(service, url, **kwargs):
+    session = get_session()
+    try:
+        response = session.post(url, **kwargs)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(service=service, reason=type(e).__name__)
+        raise
+    if response.status_code >= 400:
+        metrics.UPSTREAM_ERRORS.inc(service=service, reason=str(response.status_code))
+    return response
+
+
+# 呼叫 OpenAI Chat Completions，回傳第一個選項的文字內容
+def chat_completion(timeout=OPENAI_TIMEOUT, **payload):
+    response = _post(
+        "openai",
+        f"{OPENAI_BASE_URL}/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json=payload,
+        timeout=timeout
+    )
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"].strip()
+
+
+# 以串流方式呼叫 OpenAI Chat Completions，逐段產生回答文字（Server-Sent Events）
+def chat_completion_stream(timeout=OPENAI_TIMEOUT, **payload):
+    payload["stream"] = True
+    with _post(
+        "openai",
+        f"{OPENAI_BASE_URL}/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json=payload,
+        timeout=timeout,
+        stream=True
+    ) as response:
+        response.raise_for_status()
+        # event-stream 沒有標示編碼，逐行以 UTF-8 自行解碼
+        try:
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data.decode("utf-8")).get("choices") or []
+                if choices:
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except OSError as e:
+            # 串流途中斷線（requests 的連線例外皆為 OSError）
+            metrics.UPSTREAM_ERRORS.inc(service="openai", reason=type(e).__name__)
+            raise
+
+
+# 呼叫 LINE Push API；X-Line-Retry-Key 讓重試時不會重複推送（同一批訊息重試時請傳入相同的 retry_key）
+def line_push(user_id, messages, timeout=LINE_TIMEOUT, retry_key=None):
+    return _post(
+        "line",
+        f"{LINE_API_BASE}/v2/bot/message/push",
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
+            "X-Line-Retry-Key": retry_key or str(uuid.uuid4())
+        },
+        json={"to": user_id, "messages": messages},
+        timeout=timeout
+    )
+
+
+# 呼叫 LINE Reply API：reply token 只能使用一次，且必須在收到事件後約一分鐘內使用
+def line_reply(reply_token, messages, timeout=LINE_TIMEOUT):
+    return _post(
+        "line",
+        f"{LINE_API_BASE}/v2/bot/message/reply",
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"
+        },
+        json={"replyToken": reply_token, "messages": messages},
+        timeout=timeout
+    )
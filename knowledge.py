@@ -0,0 +1,319 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+from code_index import CodeIndex
+from federated_search import CodeSource, FederatedSearch
+from spec_index import SpecIndex
+
+# 規範與連結資料：三個 JSON 檔各自建成索引後組成一份快照；更新檔案後在背景重新解析、驗證、建索引，
+# 全部成功才一次換上新快照。請求開始時取得當下的快照，處理途中換版也不受影響
+KNOWLEDGE_FILES = {
+    "type_links": "links.json",
+    "piping_specification": "piping_specification.json",
+    "piping_heat_treatment": "piping_heat_treatment.json",
+}
+KNOWLEDGE_DESC = {
+    "type_links": "TYPE / 管線等級連結",
+    "piping_specification": "配管規範",
+    "piping_heat_treatment": "熱處理規範",
+}
+
+# 預先建好的索引快照（python knowledge.py 產生）：啟動時一次 unpickle，不必重新解析 JSON、建索引
+# 只載入本機 build 步驟產生的檔案；JSON 內容或索引程式碼改變後，對應的快照內容自動不採用
+SNAPSHOT_PATH = "knowledge_snapshot.pkl"
+SNAPSHOT_FORMAT = 1
+INDEX_MODULES = ("code_index.py", "spec_index.py")
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def validate_links(data):
+    if not isinstance(data, dict) or not data:
+        raise ValueError("內容須為非空的 {代碼: 下載連結} 物件")
+    for code, url in data.items():
+        if not isinstance(url, str) or not url.strip():
+            raise ValueError(f"{code} 的下載連結不是有效的字串")
+
+
+def validate_spec(data):
+    if not isinstance(data, dict):
+        raise ValueError("內容須為 {章: {title, content}} 物件")
+    sections = 0
+    for chapter, body in data.items():
+        if not isinstance(body, dict) or not isinstance(body.get("content", {}), dict):
+            raise ValueError(f"第 {chapter} 章格式錯誤")
+        for section, text in body.get("content", {}).items():
+            if not isinstance(text, str):
+                raise ValueError(f"第 {chapter} 章 {section} 的內容不是字串")
+            sections += 1
+    if not sections:
+        raise ValueError("沒有任何章節內容")
+
+
+# {名稱: (驗證函式, 由 JSON 建立索引的函式)}
+BUILDERS = {
+    "type_links": (validate_links, CodeIndex),
+    "piping_specification": (validate_spec, lambda data: SpecIndex(data, "piping_specification")),
+    "piping_heat_treatment": (validate_spec, lambda data: SpecIndex(data, "piping_heat_treatment")),
+}
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# 索引類別的程式碼版本，程式改版後舊快照裡的物件結構可能已不相容
+def index_code_digest():
+    base = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in INDEX_MODULES:
+        with open(os.path.join(base, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class _Source:
+    __slots__ = ("signature", "digest", "index")
+
+    def __init__(self, signature, digest, index):
+        self.signature = signature  # (mtime_ns, size)，檔案不存在時為 None
+        self.digest = digest        # 內容 hash，只是 touch 過的檔案不必重建索引
+        self.index = index
+
+
+def load_source(name, path, signature, previous=None):
+    validate, build = BUILDERS[name]
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if previous is not None and previous.digest == digest:
+        return _Source(signature, digest, previous.index)
+    data = json.loads(raw.decode("utf-8"))
+    validate(data)
+    return _Source(signature, digest, build(data))
+
+
+def build_snapshot(files=KNOWLEDGE_FILES, path=SNAPSHOT_PATH):
+    started = time.perf_counter()
+    sources = {}
+    for name, file_path in files.items():
+        source = load_source(name, file_path, file_signature(file_path))
+        sources[name] = (source.digest, source.index)
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "python": tuple(sys.version_info[:2]),
+        "code": index_code_digest(),
+        "sources": sources,
+    }
+    # 先寫到暫存檔再改名，執行中的服務不會讀到寫到一半的快照
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"✅ 已建立索引快照 {path}（{os.path.getsize(path) / 1024:.0f} KB，{elapsed_ms:.0f} ms）")
+
+
+# 回傳 {名稱: _Source}，只包含內容與目前檔案相同的部分；沒有快照或版本不符時回傳空 dict
+def load_snapshot(path, files):
+    if not path:
+        return {}
+    gc_enabled = gc.isenabled()
+    try:
+        with open(path, "rb") as f:
+            # 反序列化大量小物件時暫停 GC，避免反覆觸發回收
+            gc.disable()
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"⚠️ 無法讀取索引快照 {path}，改由 JSON 建立索引：{e}")
+        return {}
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if (payload.get("format") != SNAPSHOT_FORMAT or payload.get("python") != tuple(sys.version_info[:2])
+            or payload.get("code") != index_code_digest()):
+        print(f"⚠️ 索引快照 {path} 與目前程式版本不符，改由 JSON 建立索引（請重新執行 python knowledge.py）")
+        return {}
+
+    sources = {}
+    for name, file_path in files.items():
+        digest, index = payload["sources"].get(name, (None, None))
+        signature = file_signature(file_path)
+        if digest is None or signature is None:
+            continue
+        if file_digest(file_path) != digest:
+            print(f"⚠️ {file_path} 已更新，與索引快照不同，改由 JSON 建立索引")
+            continue
+        sources[name] = _Source(signature, digest, index)
+    return sources
+
+
+# 某一版規範資料與索引，建立後不再修改
+class KnowledgeSnapshot:
+    __slots__ = ("version", "loaded_at", "type_links", "code_index", "piping_specification_index",
+                 "piping_heat_treatment_index", "code_source", "federated_index", "spec_indexes")
+
+    def __init__(self, sources, federated_workers=1, executor=None):
+        self.version = hashlib.sha256(
+            "|".join(sources[name].digest for name in sorted(sources)).encode("utf-8")
+        ).hexdigest()[:12]
+        self.loaded_at = time.time()
+        self.code_index = sources["type_links"].index
+        self.type_links = self.code_index.links
+        self.piping_specification_index = sources["piping_specification"].index
+        self.piping_heat_treatment_index = sources["piping_heat_treatment"].index
+        self.code_source = CodeSource(self.code_index)
+        # 預設查詢同時涵蓋共同規範、熱處理規範與代碼索引，合併排名後一起列出
+        # 各語料查詢都在 1 ms 內，預設依序查詢；語料變大時可設定 FEDERATED_SEARCH_WORKERS 平行查詢
+        self.federated_index = FederatedSearch(
+            [
+                (self.piping_specification_index, "共同規範"),
+                (self.piping_heat_treatment_index, "熱處理"),
+                (self.code_source, "等級/標準圖"),
+            ],
+            max_workers=federated_workers,
+            executor=executor
+        )
+        self.spec_indexes = {
+            index.name: index
+            for index in (self.piping_specification_index, self.piping_heat_treatment_index,
+                          self.code_source, self.federated_index)
+        }
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "type_links": len(self.type_links),
+            "piping_specification": len(self.piping_specification_index),
+            "piping_heat_treatment": len(self.piping_heat_treatment_index),
+        }
+
+
+# 持有目前的快照並負責重新載入：reload() 由監看執行緒（比對檔案 mtime）或管理端點呼叫
+class KnowledgeBase:
+    def __init__(self, files=KNOWLEDGE_FILES, federated_workers=1, watch_interval=30, snapshot_path=SNAPSHOT_PATH):
+        self.files = dict(files)
+        self.federated_workers = federated_workers
+        self.watch_interval = watch_interval
+        # 平行查詢的執行緒由各版快照共用，換版時不必重建
+        self._executor = (
+            ThreadPoolExecutor(federated_workers, thread_name_prefix="federated") if federated_workers > 1 else None
+        )
+        self._reload_lock = Lock()
+        self._watcher = None
+        self._watcher_lock = Lock()
+        self.reloads = 0
+        self.last_error = None
+        started = time.perf_counter()
+        compiled = load_snapshot(snapshot_path, self.files)
+        self._sources = {
+            name: compiled.get(name) or self._initial_source(name, path) for name, path in self.files.items()
+        }
+        self._current = KnowledgeSnapshot(self._sources, federated_workers, self._executor)
+        self.load_ms = (time.perf_counter() - started) * 1000
+        self.from_snapshot = sorted(compiled)
+
+    # 啟動時檔案不存在或格式錯誤仍以空資料啟動（/ready 會回報未就緒），之後修正檔案即可由監看載入
+    def _initial_source(self, name, path):
+        build = BUILDERS[name][1]
+        try:
+            return load_source(name, path, file_signature(path))
+        except FileNotFoundError:
+            print(f"❌ 無法找到{KNOWLEDGE_DESC[name]}檔案 {path}。")
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"❌ 讀取 {path} 失敗：{e}")
+        return _Source(file_signature(path), "", build({}))
+
+    # 每個請求開始時取用一次，整個請求（含背景工作）都使用同一版資料
+    def snapshot(self):
+        self._ensure_watcher()
+        return self._current
+
+    # 重新載入有變動的檔案：全部解析、驗證、建好索引後才換上新快照，任何一個檔案有問題就保留舊版並丟出 ValueError
+    # 回傳這次更新的資料名稱列表（沒有變動時為空）；force=True 時不比對 mtime，重新讀取所有檔案
+    def reload(self, force=False):
+        with self._reload_lock:
+            started = time.perf_counter()
+            sources = {}
+            for name, path in self.files.items():
+                previous = self._sources[name]
+                signature = file_signature(path)
+                if signature == previous.signature and not force:
+                    sources[name] = previous
+                    continue
+                try:
+                    if signature is None:
+                        raise ValueError("找不到檔案")
+                    sources[name] = load_source(name, path, signature, previous)
+                except (ValueError, UnicodeDecodeError, OSError) as e:
+                    self.last_error = f"{path}：{e}"
+                    raise ValueError(self.last_error) from e
+
+            changed = [name for name in self.files if sources[name].index is not self._sources[name].index]
+            self._sources = sources
+            if changed:
+                self._current = KnowledgeSnapshot(sources, self.federated_workers, self._executor)
+                self.reloads += 1
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"🔄 已重新載入 {'、'.join(KNOWLEDGE_DESC[name] for name in changed)}"
+                      f"（版本 {self._current.version}，{elapsed_ms:.0f} ms）")
+            self.last_error = None
+            return changed
+
+    # 監看執行緒在第一次使用時才啟動（多 process 部署時 fork 之後各 worker 各自監看）
+    def _ensure_watcher(self):
+        if self._watcher is not None or not self.watch_interval:
+            return
+        with self._watcher_lock:
+            if self._watcher is None:
+                self._watcher = Thread(target=self._watch_loop, name="knowledge-watcher", daemon=True)
+                self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.watch_interval)
+            previous_error = self.last_error
+            try:
+                self.reload()
+            except ValueError as e:
+                # 檔案可能還在寫入中，下次檢查再試；同樣的錯誤只印一次
+                if str(e) != previous_error:
+                    print(f"❌ 規範資料更新失敗，繼續使用版本 {self._current.version}：{e}")
+            except Exception as e:
+                print("❌ 規範資料監看失敗:", e)
+
+    def stats(self):
+        return dict(self._current.stats(), reloads=self.reloads, last_error=self.last_error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="預先建立規範與連結的搜尋索引快照，加快服務啟動")
+    parser.add_argument("--output", default=SNAPSHOT_PATH, help="快照輸出檔案")
+    args = parser.parse_args()
+    try:
+        build_snapshot(path=args.output)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ 無法建立索引快照：{e}")
+
+
+if __name__ == "__main__":
+    main()
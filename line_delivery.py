@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import uuid
+from threading import Lock
+
+import http_client
+import metrics
+
+# LINE Messaging API 限制：每則文字訊息最多 5000 字，每次 push 最多 5 則訊息
+LINE_MAX_TEXT = 5000
+LINE_MAX_MESSAGES_PER_PUSH = 5
+
+# 串流推播的切段設定：第一段盡快送出，之後以段落為單位，每個回答最多推播幾次
+STREAM_FIRST_CHUNK_CHARS = 60
+STREAM_CHUNK_CHARS = 300
+STREAM_SOFT_MAX_CHARS = 1000
+STREAM_MAX_PUSHES = 4
+
+# 傳送失敗的重試：429 依 Retry-After 等待，其餘依指數退避；連線層（http_client）只重試連線錯誤
+# Retry-After 超過 LINE_BACKOFF_MAX_SECONDS 時不再重試，避免背景工作長時間佔住執行緒
+LINE_DELIVERY_ATTEMPTS = int(os.getenv("LINE_DELIVERY_ATTEMPTS", 4))
+LINE_BACKOFF_SECONDS = float(os.getenv("LINE_BACKOFF_SECONDS", 1.0))
+LINE_BACKOFF_MAX_SECONDS = 30.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# reply token 約一分鐘內有效，保留一點餘裕
+REPLY_TOKEN_TTL_SECONDS = 50
+
+_SENTENCE_END_RE = re.compile(r"[。！？!?；\n]")
+
+
+# 找出可以切段的位置（切在段落或句子結尾之後），找不到合適位置時回傳 None
+def _find_cut(buffer, min_chars):
+    if len(buffer) < min_chars:
+        return None
+    paragraph = buffer.rfind("\n\n", min_chars)
+    if paragraph != -1:
+        return paragraph + 2
+    if len(buffer) >= STREAM_SOFT_MAX_CHARS or min_chars == STREAM_FIRST_CHUNK_CHARS:
+        sentence_ends = [m.end() for m in _SENTENCE_END_RE.finditer(buffer, min_chars)]
+        if sentence_ends:
+            return sentence_ends[-1]
+    if len(buffer) >= LINE_MAX_TEXT:
+        return LINE_MAX_TEXT
+    return None
+
+
+# 將長文字切成不超過 limit 字的多段，優先切在段落、句子結尾
+def split_text(text, limit=LINE_MAX_TEXT):
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = window.rfind("\n\n")
+        if cut < limit // 2:
+            sentence_ends = [m.end() for m in _SENTENCE_END_RE.finditer(window)]
+            cut = sentence_ends[-1] if sentence_ends and sentence_ends[-1] >= limit // 2 else limit
+        parts.append(text[:cut].strip())
+        text = text[cut:]
+    if text.strip():
+        parts.append(text.strip())
+    return parts
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# LINE 訊息傳送：同一位使用者的訊息依序送出，送出途中又進來的訊息合併成下一批（每批最多 5 則）；
+# 有保留的 reply token 時先用 Reply API（不計入推播額度），失敗或逾時再改用 Push API，
+# 429 / 5xx / 連線錯誤以相同的 retry key 重試，不會重複送達
+class LineDelivery:
+    def __init__(self, attempts=LINE_DELIVERY_ATTEMPTS, backoff_seconds=LINE_BACKOFF_SECONDS,
+                 max_backoff_seconds=LINE_BACKOFF_MAX_SECONDS, reply_token_ttl=REPLY_TOKEN_TTL_SECONDS, sleep=time.sleep):
+        self.attempts = max(1, attempts)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.reply_token_ttl = reply_token_ttl
+        self.sleep = sleep
+        self._lock = Lock()
+        self._pending = {}       # {user_id: [文字, ...]}，有值代表已有執行緒正在送出這位使用者的訊息
+        self._reply_tokens = {}  # {user_id: (reply token, 收到的時間)}
+        self._blocked_until = 0.0  # 收到 429 後，所有傳送都暫停到這個時間
+        self.requests = 0
+        self.replies = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    # webhook 沒有用掉 reply token 時保留下來，這位使用者的下一批訊息優先以 Reply API 送出
+    def hold_reply_token(self, user_id, reply_token):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._reply_tokens) > 1000:
+                self._reply_tokens = {
+                    user: item for user, item in self._reply_tokens.items() if now - item[1] < self.reply_token_ttl
+                }
+            self._reply_tokens[user_id] = (reply_token, now)
+
+    def _take_reply_token(self, user_id):
+        with self._lock:
+            item = self._reply_tokens.pop(user_id, None)
+        if item and time.monotonic() - item[1] < self.reply_token_ttl:
+            return item[0]
+        return None
+
+    # 送出文字訊息（超過單則字數上限的會先切段），回傳是否全部送達；
+    # 這位使用者已有訊息在送出中時只加入佇列，由正在送出的執行緒一起送出，直接回傳 True
+    def send(self, user_id, texts):
+        texts = [part for text in texts if text for part in split_text(text)]
+        if not texts:
+            return True
+        with self._lock:
+            queue = self._pending.get(user_id)
+            if queue is not None:
+                queue.extend(texts)
+                self.coalesced += len(texts)
+                return True
+            queue = self._pending[user_id] = list(texts)
+
+        delivered = True
+        while True:
+            with self._lock:
+                batch = queue[:LINE_MAX_MESSAGES_PER_PUSH]
+                del queue[:len(batch)]
+                if not batch:
+                    del self._pending[user_id]
+                    break
+            delivered = self._deliver(user_id, batch) and delivered
+        return delivered
+
+    def _deliver(self, user_id, batch):
+        messages = [{"type": "text", "text": text} for text in batch]
+        reply_token = self._take_reply_token(user_id)
+        if reply_token:
+            response = self._call("reply", http_client.line_reply, reply_token, messages)
+            if response is not None and response.status_code == 200:
+                with self._lock:
+                    self.replies += 1
+                print(f"✅ 以 reply token 回覆 {len(batch)} 則訊息至 LINE")
+                return True
+            print("⚠️ reply token 無法使用，改用推播")
+
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.attempts):
+            if not self._wait_for_rate_limit():
+                print("⏳ LINE 限流暫停時間過長，不再等待")
+                break
+            response = self._call("push", http_client.line_push, user_id, messages, retry_key=retry_key)
+            status = response.status_code if response is not None else None
+            # 409：同一個 retry key 先前已經送達（例如回應在途中遺失）
+            if status in (200, 409):
+                print(f"✅ 成功推送 {len(batch)} 則訊息至 LINE")
+                return True
+            if status is not None and status not in RETRYABLE_STATUSES:
+                print(f"❌ 推送訊息失敗：{status}, {response.text}")
+                break
+            if attempt + 1 < self.attempts:
+                delay = self._backoff(attempt, response)
+                if delay is None:
+                    print(f"❌ LINE 要求 {_retry_after(response):.0f} 秒後再試，超過等待上限")
+                    break
+                with self._lock:
+                    self.retries += 1
+                print(f"⏳ LINE 推播失敗（{status or '連線錯誤'}），{delay:.1f} 秒後重試")
+                self.sleep(delay)
+        with self._lock:
+            self.failed += 1
+        print(f"❌ 推送訊息失敗，{len(batch)} 則訊息未送達")
+        return False
+
+    def _call(self, api, fn, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+        try:
+            with metrics.stage_timer(api):
+                return fn(*args, **kwargs)
+        except Exception as e:
+            print(f"❌ 呼叫 LINE {api} API 失敗：{e}")
+            return None
+
+    # 回傳重試前要等待的秒數；Retry-After 超過上限時回傳 None（提早重試只會再收到 429）
+    def _backoff(self, attempt, response):
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        if response is not None and response.status_code == 429:
+            delay = _retry_after(response) or delay
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            if delay > self.max_backoff_seconds:
+                return None
+        return delay
+
+    # 等到 429 的暫停時間結束；剩餘時間超過等待上限時回傳 False
+    def _wait_for_rate_limit(self):
+        remaining = self._blocked_until - time.monotonic()
+        if remaining > self.max_backoff_seconds:
+            return False
+        if remaining > 0:
+            self.sleep(remaining)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "replies": self.replies,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+                "queued": sum(len(queue) for queue in self._pending.values()),
+                "reply_tokens": len(self._reply_tokens),
+            }
+
+
+delivery = LineDelivery()
+
+
+# 推播多則文字訊息（自動切段並每 5 則一批），回傳是否成功
+def push_texts(user_id, texts):
+    return delivery.send(user_id, texts)
+
+
+# 一邊接收串流文字一邊以段落為單位推播，回傳完整回答
+# 前 STREAM_MAX_PUSHES - 1 次各推一段，剩下的內容最後一起送出（每 5 則一批）
+def stream_to_line(user_id, deltas, send=push_texts):
+    received = []
+    buffer = ""
+    pushes = 0
+    for delta in deltas:
+        received.append(delta)
+        buffer += delta
+        if pushes >= STREAM_MAX_PUSHES - 1:
+            continue
+        cut = _find_cut(buffer, STREAM_FIRST_CHUNK_CHARS if pushes == 0 else STREAM_CHUNK_CHARS)
+        if cut:
+            send(user_id, [buffer[:cut].strip()])
+            buffer = buffer[cut:]
+            pushes += 1
+
+    if buffer.strip():
+        send(user_id, split_text(buffer.strip()))
+    return "".join(received).strip()
@@ -0,0 +1,237 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+# 各處理階段的耗時與計數，以 Prometheus 文字格式由 /metrics 輸出（不另外依賴 prometheus_client）
+# 數值存在各 worker process 的記憶體中；gunicorn 多 worker 時每次抓取只會看到處理該請求的 process
+
+# 秒；涵蓋本機比對（毫秒以下）到 GPT 長回答（數十秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 目前處理中的 intent：webhook 請求開始時設定，背景工作由 worker_pool 連同 context 一起帶過去
+_intent = ContextVar("metrics_intent", default="")
+
+
+def set_intent(intent):
+    _intent.set(intent or "")
+
+
+def current_intent():
+    return _intent.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _sample_lines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._sample_lines())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    # 每個標籤組合存 [各區間筆數（非累計，最後一格為 +Inf）, 總和, 筆數]
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][slot] += 1
+            state[1] += value
+            state[2] += 1
+
+    def value(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _sample_lines(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+# 抓取時才向既有物件讀取數值（工作池、快取統計），平常不增加任何負擔
+# collect() 回傳 {標籤值 tuple: 數值}
+class CallbackMetric(_Metric):
+    def __init__(self, name, help_text, labelnames, collect, kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def _sample_lines(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"❌ 讀取指標 {self.name} 失敗：{e}")
+            return
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, labelnames, collect, kind="gauge"):
+        return self.register(CallbackMetric(name, help_text, labelnames, collect, kind))
+
+    # Prometheus text exposition format 0.0.4
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "webhook_request_seconds", "Webhook 請求的處理時間（秒）", ("intent",))
+HANDLER_SECONDS = REGISTRY.histogram(
+    "webhook_handler_seconds", "各 intent / context handler 的執行時間（秒）", ("handler",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "webhook_stage_seconds", "各處理階段的耗時（秒）：parse、search、translate、summarize、gpt、push 等", ("stage", "intent"))
+CACHE_REQUESTS = REGISTRY.counter(
+    "webhook_cache_requests_total", "快取查詢次數", ("cache", "result"))
+SEARCH_CANDIDATES = REGISTRY.counter(
+    "webhook_search_candidates_scored_total", "模糊比對實際計算分數的候選項目數", ("corpus",))
+SEARCHES = REGISTRY.counter(
+    "webhook_searches_total", "模糊比對的查詢次數", ("corpus",))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "webhook_upstream_errors_total", "呼叫外部服務失敗的次數（HTTP 狀態碼或例外類型）", ("service", "reason"))
+
+
+def register_executor(executor):
+    def in_flight():
+        stats = executor.stats()
+        return {(executor.name, "queued"): stats["queued"], (executor.name, "running"): stats["running"]}
+
+    def finished():
+        stats = executor.stats()
+        return {(executor.name, "completed"): stats["completed"], (executor.name, "rejected"): stats["rejected"]}
+
+    REGISTRY.callback("webhook_background_jobs", "背景工作池中排隊與執行中的工作數",
+                      ("pool", "state"), in_flight)
+    REGISTRY.callback("webhook_background_jobs_total", "背景工作池已完成與被拒絕的工作數",
+                      ("pool", "result"), finished, kind="counter")
+
+
+# 計時某個處理階段，標籤帶入目前的 intent
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, intent=_intent.get())
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+
+from code_index import CodeIndex, canonical_code
+from spec_index import text_grams, normalize_text
+
+# 管線等級表（Pipe Class）：由 PDF 轉成以等級代碼為 key 的 JSON，查詢時只把該等級的內容交給 GPT，
+# 單純查表的問題（適用流體、磅級、材質…）直接在本地回答
+PIPE_CLASS_FILES = {
+    "refinery": "pipe_class_refinery.json",
+    "olefin": "pipe_class_olefin.json",
+}
+PIPE_CLASS_DESC = {"refinery": "煉油", "olefin": "烯烴"}
+CHUNK_CHARS = 1500
+REFERENCE_MAX_CHARS = 6000
+
+# 頁首的等級代碼，例如「PIPING CLASS : A012」「CLASS A1D」「管線等級：A012」
+_PAGE_CODE_RE = re.compile(r"(?:PIP(?:E|ING)\s*CLASS|CLASS|等級)\s*(?:NO\.?)?\s*[:：]?\s*([A-Z]{1,2}\d{1,4}[A-Z0-9]*)", re.I)
+_QUERY_CODE_RE = re.compile(r"[A-Z]{1,2}\d{1,4}[A-Z0-9]*")
+
+# 可直接查表回答的欄位：labels 用於從等級表文字中擷取，keywords 用於判斷問題在問哪個欄位
+TABLE_FIELDS = {
+    "service": {
+        "name": "適用流體",
+        "labels": ["SERVICE", "FLUID", "FLUID SERVICE", "適用流體", "流體"],
+        "keywords": ["流體", "介質", "用途", "哪些流", "service", "fluid"],
+    },
+    "rating": {
+        "name": "壓力等級",
+        "labels": ["RATING", "PRESSURE RATING", "FLANGE RATING", "壓力等級", "磅級"],
+        "keywords": ["磅級", "壓力等級", "rating", "幾磅"],
+    },
+    "material": {
+        "name": "材質",
+        "labels": ["MATERIAL", "BASE MATERIAL", "PIPE MATERIAL", "材質"],
+        "keywords": ["材質", "材料", "material"],
+    },
+    "corrosion_allowance": {
+        "name": "腐蝕裕度",
+        "labels": ["CORROSION ALLOWANCE", "C.A.", "CA", "腐蝕裕度"],
+        "keywords": ["腐蝕裕度", "腐蝕", "corrosion"],
+    },
+    "temperature": {
+        "name": "設計溫度範圍",
+        "labels": ["DESIGN TEMPERATURE", "DESIGN TEMP.", "DESIGN TEMP", "TEMPERATURE RANGE", "TEMP. RANGE", "設計溫度"],
+        "keywords": ["溫度", "temperature", "temp"],
+    },
+}
+
+_FIELD_LINE_RES = {
+    field: re.compile(
+        r"^\s*(?:" + "|".join(re.escape(label) for label in sorted(spec["labels"], key=len, reverse=True)) + r")\s*[:：]\s*(.+?)\s*$",
+        re.I | re.M
+    )
+    for field, spec in TABLE_FIELDS.items()
+}
+
+
+# ---------- 轉檔（離線執行） ----------
+
+# 讀取 PDF 的每一頁文字（需要 pdfplumber）；.txt 檔以換頁字元 \f 分頁，方便先用其他工具轉好的文字
+def read_pages(path):
+    if path.lower().endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().split("\f")
+    try:
+        import pdfplumber
+    except ImportError:
+        raise SystemExit("❌ 轉換 PDF 需要 pdfplumber，請先執行 pip install pdfplumber")
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            # 表格另外擷取成「欄位: 值」的行，讓後續欄位擷取不受版面影響
+            for table in page.extract_tables():
+                for row in table:
+                    cells = [cell.strip() for cell in row if cell and cell.strip()]
+                    if len(cells) >= 2:
+                        text += "\n" + cells[0] + ": " + " ".join(cells[1:])
+            pages.append(text)
+    return pages
+
+
+def chunk_text(text, size=CHUNK_CHARS):
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n"):
+        if current and len(current) + len(paragraph) + 1 > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def extract_fields(text):
+    fields = {}
+    for field, pattern in _FIELD_LINE_RES.items():
+        match = pattern.search(text)
+        if match:
+            fields[field] = match.group(1)
+    return fields
+
+
+# 依頁首的等級代碼把頁面歸到各等級（沒有代碼的頁面視為上一個等級的續頁），只接受 links.json 裡存在的代碼
+def ingest(pages, code_index, source):
+    grades = {}
+    current = None
+    for page_no, text in enumerate(pages, 1):
+        header = "\n".join(text.strip().splitlines()[:5])
+        for candidate in _PAGE_CODE_RE.findall(header):
+            found = code_index.lookup(candidate)
+            if found:
+                current = found[0]
+                break
+        if current is None or not text.strip():
+            continue
+        grade = grades.setdefault(current, {"title": current, "source": source, "pages": [], "text": []})
+        grade["pages"].append(page_no)
+        grade["text"].append(text.strip())
+
+    result = {}
+    for code, grade in grades.items():
+        text = "\n".join(grade["text"])
+        result[code] = {
+            "title": grade["title"],
+            "source": f"{grade['source']} p.{grade['pages'][0]}-{grade['pages'][-1]}",
+            "fields": extract_fields(text),
+            "content": {str(i): chunk for i, chunk in enumerate(chunk_text(text), 1)},
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將管線等級表 PDF 轉成以等級代碼為 key 的 JSON")
+    parser.add_argument("corpus", choices=sorted(PIPE_CLASS_FILES), help="refinery（煉油）或 olefin（烯烴）")
+    parser.add_argument("sources", nargs="+", help="管線等級表 PDF（或以 \\f 分頁的 .txt）")
+    parser.add_argument("--links", default="links.json", help="等級代碼清單，用來辨識頁首的代碼")
+    parser.add_argument("--output", help="輸出檔案（預設依 corpus 決定）")
+    args = parser.parse_args()
+
+    with open(args.links, "r", encoding="utf-8") as f:
+        code_index = CodeIndex(json.load(f))
+
+    grades = {}
+    for path in args.sources:
+        parsed = ingest(read_pages(path), code_index, os.path.basename(path))
+        print(f"📄 {path}：{len(parsed)} 個等級")
+        grades.update(parsed)
+
+    output = args.output or PIPE_CLASS_FILES[args.corpus]
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(grades, f, ensure_ascii=False, indent=2, sort_keys=True)
+    with_fields = sum(1 for grade in grades.values() if grade["fields"])
+    print(f"✅ 共 {len(grades)} 個等級（{with_fields} 個擷取到表格欄位），已寫入 {output}")
+
+
+# ---------- 查詢（webhook 使用） ----------
+
+# 已轉檔的管線等級表；沒有 JSON 的 corpus 仍沿用附加整份 PDF 的做法
+class PipeClassLibrary:
+    def __init__(self, files=PIPE_CLASS_FILES):
+        self.grades = {}  # {corpus: {code: grade}}
+        self.by_canonical = {}  # {corpus: {正規化代碼: code}}
+        for corpus, path in files.items():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.grades[corpus] = json.load(f)
+                self.by_canonical[corpus] = {canonical_code(code): code for code in self.grades[corpus]}
+                print(f"✅ 載入 {len(self.grades[corpus])} 個{PIPE_CLASS_DESC.get(corpus, corpus)}管線等級")
+            except FileNotFoundError:
+                print(f"⚠️ 找不到 {path}，{PIPE_CLASS_DESC.get(corpus, corpus)}管線等級問題將附加整份 PDF")
+
+    def __len__(self):
+        return sum(len(grades) for grades in self.grades.values())
+
+    # 問題中提到、且已轉檔的第一個等級代碼
+    def find_code(self, corpus, question):
+        by_canonical = self.by_canonical.get(corpus)
+        if not by_canonical:
+            return None
+        for candidate in _QUERY_CODE_RE.findall(question.upper()):
+            code = by_canonical.get(canonical_code(candidate))
+            if code:
+                return code
+        return None
+
+    def get(self, corpus, code):
+        return self.grades.get(corpus, {}).get(code)
+
+    # 等級內容的版本（內容 hash），作為回答快取 key 的一部分，重新轉檔後舊回答自動失效
+    def version(self, corpus, code):
+        grade = self.get(corpus, code)
+        digest = hashlib.sha256(json.dumps(grade, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{corpus}:{code}:{digest[:12]}"
+
+    # 問題只問到一個可查表的欄位、且該等級有這個欄位時，直接回傳答案；否則回傳 None 交給 GPT
+    def local_answer(self, corpus, code, question):
+        grade = self.get(corpus, code)
+        if not grade:
+            return None
+        lowered = question.lower()
+        asked = [field for field, spec in TABLE_FIELDS.items() if any(k in lowered for k in spec["keywords"])]
+        if len(asked) != 1 or asked[0] not in grade.get("fields", {}):
+            return None
+        field = asked[0]
+        return (
+            f"📋 {code}（{PIPE_CLASS_DESC.get(corpus, corpus)}管線等級）{TABLE_FIELDS[field]['name']}：\n"
+            f"{grade['fields'][field]}\n\n資料來源：{grade['source']}"
+        )
+
+    # 交給 GPT 的參考資料：該等級的內容，超過上限時依與問題的字詞重疊挑選段落（保持原順序）
+    def reference(self, corpus, code, question, max_chars=REFERENCE_MAX_CHARS):
+        grade = self.get(corpus, code)
+        chunks = list(grade["content"].values())
+        if sum(len(chunk) for chunk in chunks) > max_chars:
+            query_grams = text_grams(normalize_text(question))
+            ranked = sorted(
+                range(len(chunks)),
+                key=lambda i: -len(query_grams & text_grams(normalize_text(chunks[i])))
+            )
+            selected, used = set(), 0
+            for i in ranked:
+                if used + len(chunks[i]) > max_chars and selected:
+                    continue
+                selected.add(i)
+                used += len(chunks[i])
+            chunks = [chunks[i] for i in sorted(selected)]
+        fields = "\n".join(f"{TABLE_FIELDS[f]['name']}: {v}" for f, v in grade.get("fields", {}).items())
+        body = "\n\n".join(chunks)
+        return f"管線等級 {code}（{grade['source']}）\n{fields}\n\n{body}".strip()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock, Thread, local
+
+
+# 對話歷史儲存：依 session 保存訊息列表，超過 ttl 未使用即失效，總筆數超過上限時淘汰最久未使用的
+class SessionStore(ABC):
+    def __init__(self, ttl_seconds=300, max_entries=5000, sweep_interval=60):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_lock = Lock()
+
+    # 回傳該 session 的訊息列表（副本）；不存在或已過期時回傳空列表
+    @abstractmethod
+    def load(self, session_id):
+        pass
+
+    @abstractmethod
+    def save(self, session_id, messages):
+        pass
+
+    @abstractmethod
+    def clear(self, session_id):
+        pass
+
+    # 移除過期與超出上限的 session，回傳移除筆數
+    @abstractmethod
+    def sweep(self):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    # 背景清理執行緒在第一次使用時才啟動（多 process 部署時 fork 之後才會建立）
+    def _ensure_sweeper(self):
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"🧹 清除 {removed} 筆過期對話")
+            except Exception as e:
+                print("❌ 清除過期對話失敗:", e)
+
+
+# 單一 process 內的記憶體儲存
+class MemorySessionStore(SessionStore):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._items = OrderedDict()  # {session_id: (last_seen, messages)}
+        self._lock = Lock()
+
+    def load(self, session_id):
+        self._ensure_sweeper()
+        with self._lock:
+            item = self._items.get(session_id)
+            if item is None:
+                return []
+            if time.time() - item[0] > self.ttl_seconds:
+                del self._items[session_id]
+                return []
+            return list(item[1])
+
+    def save(self, session_id, messages):
+        self._ensure_sweeper()
+        with self._lock:
+            self._items[session_id] = (time.time(), list(messages))
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [key for key, (last_seen, _) in self._items.items() if last_seen < cutoff]
+            for key in expired:
+                del self._items[key]
+            return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+# 本機共用的 SQLite（WAL 模式）儲存，讓同一台機器上的多個 worker process 看到同一份歷史
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path="sessions.db", **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = local()
+        db = self._conn()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+        db.commit()
+
+    # sqlite3 連線不可跨執行緒或 fork 後共用，每個執行緒（每個 process）各開一條
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def load(self, session_id):
+        self._ensure_sweeper()
+        row = self._conn().execute(
+            "SELECT messages FROM sessions WHERE session_id = ? AND last_seen >= ?",
+            (session_id, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def save(self, session_id, messages):
+        self._ensure_sweeper()
+        db = self._conn()
+        db.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, messages, last_seen) VALUES (?, ?, ?)",
+            (session_id, json.dumps(messages, ensure_ascii=False), time.time())
+        )
+        db.commit()
+
+    def clear(self, session_id):
+        db = self._conn()
+        db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        db.commit()
+
+    def sweep(self):
+        db = self._conn()
+        removed = db.execute(
+            "DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        removed += db.execute(
+            "DELETE FROM sessions WHERE session_id NOT IN "
+            "(SELECT session_id FROM sessions ORDER BY last_seen DESC LIMIT ?)",
+            (self.max_entries,)
+        ).rowcount
+        db.commit()
+        return removed
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# 依環境變數 SESSION_STORE（memory / sqlite）建立對話歷史儲存
+def create_session_store(ttl_seconds=300):
+    kwargs = {
+        "ttl_seconds": ttl_seconds,
+        "max_entries": int(os.getenv("SESSION_MAX_ENTRIES", 5000)),
+        "sweep_interval": int(os.getenv("SESSION_SWEEP_INTERVAL", 60)),
+    }
+    if os.getenv("SESSION_STORE", "memory").lower() == "sqlite":
+        return SQLiteSessionStore(path=os.getenv("SESSION_DB_PATH", "sessions.db"), **kwargs)
+    return MemorySessionStore(**kwargs)
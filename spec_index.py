@@ -0,0 +1,167 @@
+import heapq
+import re
+import time
+from collections import Counter, OrderedDict, defaultdict
+from threading import Lock
+from fuzzywuzzy import fuzz
+
+import metrics
+
+# 去除所有空白字元（比對前先正規化）
+_WHITESPACE_RE = re.compile(r"\s+")
+# 中日韓文字取 2-gram，英數字取 3-gram
+_CJK_RUN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+_LATIN_RUN_RE = re.compile(r"[a-z0-9]+")
+
+# 候選篩選的容許誤差（浮點數比較用）
+_BOUND_EPSILON = 1e-9
+
+
+def normalize_text(text):
+    return _WHITESPACE_RE.sub("", text or "").lower()
+
+
+def _runs_to_grams(runs, n):
+    grams = set()
+    for run in runs:
+        if len(run) <= n:
+            grams.add(run)
+        else:
+            grams.update(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+# 將已正規化的文字切成 n-gram 集合
+def text_grams(cleaned):
+    return _runs_to_grams(_CJK_RUN_RE.findall(cleaned), 2) | _runs_to_grams(_LATIN_RUN_RE.findall(cleaned), 3)
+
+
+class SpecEntry:
+    __slots__ = ("chapter", "title", "section", "text", "cleaned", "label", "order")
+
+    def __init__(self, chapter, title, section, text, order=0):
+        self.chapter = chapter
+        self.title = title
+        self.section = section
+        self.text = text
+        self.cleaned = normalize_text(text)
+        self.label = f"第{chapter}章 {title} - {section}"
+        self.order = order  # 在原始 JSON 中的章節順序，同分時排前面
+
+
+# 規範索引：啟動時先把每一節的文字清理好，查詢時只需正規化問題再計分
+# 另建字元倒排索引，先用共同字元數篩出可能達到門檻的章節，只對候選做 fuzz.partial_ratio
+class SpecIndex:
+    def __init__(self, spec_data, name=""):
+        self.name = name
+        self.entries = []
+        self.by_key = {}  # {(chapter, section): entry}
+        self.postings = defaultdict(list)  # {字元: [(entry 序號, 出現次數), ...]}
+        for chapter, data in spec_data.items():
+            title = data.get("title", "")
+            for sec_num, sec_text in data.get("content", {}).items():
+                entry = SpecEntry(chapter, title, sec_num, sec_text, len(self.entries))
+                for char, count in Counter(entry.cleaned).items():
+                    self.postings[char].append((len(self.entries), count))
+                self.entries.append(entry)
+                self.by_key[(chapter, sec_num)] = entry
+
+    # 挑出分數可能達到 threshold 的章節；門檻不設限時回傳 None 代表需全掃
+    # partial_ratio 以較短字串（m 字）對較長字串中長度 s ≤ m 的片段計算 2·LCS/(m+s)，四捨五入後 ≥ threshold
+    # 代表比值 ≥ ρ = (threshold - 0.5)/100；又 LCS ≤ s，可得 LCS ≥ ρ·m/(2-ρ)。
+    # LCS 不會超過兩者的共同字元數（各字元取較少的出現次數），共同字元數低於下限的章節不可能達到門檻，略過不會漏掉結果
+    def candidates(self, query_cleaned, threshold=70):
+        ratio = (threshold - 0.5) / 100
+        if ratio <= 0:
+            return None
+
+        common = defaultdict(int)
+        for char, count in Counter(query_cleaned).items():
+            for idx, entry_count in self.postings.get(char, ()):
+                common[idx] += min(count, entry_count)
+
+        factor = ratio / (2 - ratio)
+        query_len = len(query_cleaned)
+        return sorted(
+            idx for idx, count in common.items()
+            if count >= factor * min(query_len, len(self.entries[idx].cleaned)) - _BOUND_EPSILON
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    # 精簡參照格式「語料庫|章|節」，讓 Dialogflow context 只需帶幾十個位元組
+    def ref(self, entry):
+        return f"{self.name}|{entry.chapter}|{entry.section}"
+
+    def get(self, chapter, section):
+        return self.by_key.get((chapter, section))
+
+    # 回傳 [(score, entry), ...]，依分數高到低排列，同分依章節順序
+    # top_k 有值時只用大小為 k 的 heap 保留最佳結果；full_scan=True 時略過候選篩選
+    def search(self, query, top_k=None, threshold=70, full_scan=False):
+        query_cleaned = normalize_text(query)
+        if not query_cleaned:
+            return []
+
+        candidate_ids = None if full_scan else self.candidates(query_cleaned, threshold)
+        if candidate_ids is None:
+            candidate_ids = range(len(self.entries))
+        metrics.SEARCHES.inc(corpus=self.name)
+        metrics.SEARCH_CANDIDATES.inc(len(candidate_ids), corpus=self.name)
+
+        heap = []
+        for idx in candidate_ids:
+            entry = self.entries[idx]
+            score = fuzz.partial_ratio(query_cleaned, entry.cleaned)
+            if score < threshold:
+                continue
+            item = (score, -entry.order, entry)
+            if top_k is None or len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+
+        ranked = sorted(heap, key=lambda item: item[:2], reverse=True)
+        return [(score, entry) for score, _, entry in ranked]
+
+
+# 伺服器端暫存的查詢結果（供「更多」翻頁使用），有筆數上限與存活時間
+class SpecResultStore:
+    def __init__(self, max_entries=1000, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def put(self, key, hits, spec_type_desc, spec_index):
+        with self._lock:
+            self._items[key] = (time.monotonic(), hits, spec_type_desc, spec_index)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    # 回傳 (hits, spec_type_desc, spec_index)，過期或不存在則回傳 None
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            created, hits, spec_type_desc, spec_index = item
+            if time.monotonic() - created > self.ttl_seconds:
+                del self._items[key]
+                return None
+            return hits, spec_type_desc, spec_index
+
+
+# 由「語料庫|章|節」參照找回章節；找不到（例如規範已改版）時回傳 None
+def resolve_ref(indexes, ref):
+    parts = str(ref).split("|", 2)
+    if len(parts) != 3:
+        return None
+    index = indexes.get(parts[0])
+    return index.get(parts[1], parts[2]) if index else None
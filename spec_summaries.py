@@ -0,0 +1,108 @@
+import argparse
+import hashlib
+import json
+import os
+from threading import Lock
+
+from http_client import chat_completion
+
+# 超過此字數的章節才需要重點整理
+SUMMARY_MIN_CHARS = 300
+SUMMARIES_FILE = "spec_summaries.json"
+SPEC_FILES = ["piping_specification.json", "piping_heat_treatment.json"]
+SUMMARY_PROMPT = "你是配管設計專家，請將以下配管規範內容進行條列式重點整理，保留原意並清楚簡明。"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def summarize_section(content):
+    return chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": content}
+        ],
+        max_tokens=400,
+        temperature=0.3,
+        top_p=0.8
+    )
+
+
+# 預先產生的章節摘要（以內文 hash 為 key），內文改版後 hash 不同就會自動失效
+class SpecSummaries:
+    def __init__(self, path=SUMMARIES_FILE):
+        self.path = path
+        self._items = {}
+        self._lock = Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._items = json.load(f)
+            print(f"✅ 載入 {len(self._items)} 筆預先產生的規範摘要")
+        except FileNotFoundError:
+            print(f"⚠️ 找不到 {path}，長章節將即時呼叫 GPT 摘要")
+
+    def get(self, content):
+        with self._lock:
+            return self._items.get(content_hash(content))
+
+    # 即時產生的摘要只保留在記憶體，下次執行批次產生時才寫回檔案
+    def put(self, content, summary):
+        with self._lock:
+            self._items[content_hash(content)] = summary
+
+
+def iter_long_sections(spec_files, min_chars=SUMMARY_MIN_CHARS):
+    for path in spec_files:
+        with open(path, "r", encoding="utf-8") as f:
+            spec_data = json.load(f)
+        for chapter, data in spec_data.items():
+            for sec_num, sec_text in data.get("content", {}).items():
+                if len(sec_text) > min_chars:
+                    yield f"{path} 第{chapter}章 {sec_num}", sec_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次產生長規範章節的 GPT 重點整理")
+    parser.add_argument("--output", default=SUMMARIES_FILE, help="摘要輸出檔案")
+    parser.add_argument("--force", action="store_true", help="忽略既有摘要，全部重新產生")
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要產生摘要的章節")
+    parser.add_argument("spec_files", nargs="*", default=SPEC_FILES)
+    args = parser.parse_args()
+
+    existing = {}
+    if not args.force and os.path.exists(args.output):
+        with open(args.output, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+
+    summaries = {}
+    generated = 0
+    for name, text in iter_long_sections(args.spec_files):
+        key = content_hash(text)
+        if key in summaries:
+            continue
+        if key in existing:
+            summaries[key] = existing[key]
+            continue
+
+        print(f"📄 產生摘要：{name}")
+        if args.dry_run:
+            continue
+        try:
+            summaries[key] = summarize_section(text)
+            generated += 1
+        except Exception as e:
+            print(f"❌ GPT 摘要失敗（{name}）:", e)
+
+    if args.dry_run:
+        return
+
+    # 只保留目前仍存在的章節，改版後舊的摘要自然被淘汰
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"✅ 共 {len(summaries)} 筆摘要（新產生 {generated} 筆），已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
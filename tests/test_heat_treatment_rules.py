@@ -0,0 +1,79 @@
+import pytest
+
+import heat_treatment_rules as rules
+
+
+# (問題, P-No., 厚度 mm, NPS, SMTS MPa)
+PARSE_CASES = [
+    ("P-No.4 管徑 8mm 需要後熱嗎", "4", 8.0, None, None),
+    ('碳鋼 3/4" 10mm 預熱', "1", 10.0, 0.75, 415),
+    ('碳鋼 1-1/2" 10mm 預熱', "1", 10.0, 1.5, 415),
+    ("碳鋼 1 1/2吋 10mm 預熱", "1", 10.0, 1.5, 415),
+    ('P-No.4 NPS 8" 12mm PWHT', "4", 12.0, 8.0, None),
+    ('NPS 8 管徑 6" P-No.1 10mm 預熱', "1", 10.0, None, None),
+    ("P22 20mm 預熱", "5A", 20.0, None, 415),
+    ("P91 20mm 預熱", "15E", 20.0, None, 585),
+    ("P9 20mm 預熱", "5B", 20.0, None, 415),
+    ("P-No.15E 20mm PWHT", "15E", 20.0, None, None),
+    ("P-No.1 C 0.35% 20mm 預熱", "1", 20.0, None, None),
+]
+
+
+@pytest.mark.parametrize("question, p_number, thickness, nps, smts", PARSE_CASES)
+def test_parse_query(question, p_number, thickness, nps, smts):
+    params = rules.parse_query(question)
+    assert params["p_number"] == p_number
+    assert params["thickness_mm"] == thickness
+    assert params["nps"] == nps
+    assert params["smts_mpa"] == smts
+
+
+# (問題, 最低預熱 °C, 後熱（True 需要 / False 不需要 / "?" 取決於管徑）, PWHT 是否需要)
+LOOKUP_CASES = [
+    ("碳鋼 10mm 預熱", 10, False, False),
+    ("碳鋼 25mm 預熱", 79, False, True),
+    ("碳鋼 24.9mm 預熱", 10, False, True),
+    ("P-No.1 10mm 預熱", 79, False, False),  # 不知道 SMTS，不能用 ≤ 490 MPa 的 10°C
+    ("P-No.3 13mm 預熱", 79, False, False),
+    ("P-No.3 12mm 預熱", 79, False, False),
+    ("P22 20mm 預熱", 204, True, True),
+    ("P91 20mm 預熱", 204, True, True),
+    ("P-No.4 管徑 8mm 需要後熱嗎", 121, "?", True),
+    ("P-No.4 NPS 4 8mm 後熱", 121, False, True),
+    ('P-No.4 NPS 8" 8mm 後熱', 121, True, True),
+    ("P-No.4 12mm C 0.12% PWHT", 121, True, False),
+    ("P-No.4 12mm C 0.2% PWHT", 121, True, True),
+    ("P-No.4 12mm PWHT", 121, True, True),  # 不知道含碳量，不能宣稱免除
+    ("碳鋼 C 0.35% 10mm 預熱", 80, False, False),
+    ("不銹鋼 30mm PWHT", 10, False, False),
+]
+
+
+@pytest.mark.parametrize("question, min_c, postheat, pwht_required", LOOKUP_CASES)
+def test_lookup(question, min_c, postheat, pwht_required):
+    result = rules.lookup(**rules.parse_query(question))
+    assert result["preheat"]["min_c"] == min_c
+    post = result["postheat"]
+    if postheat == "?":
+        assert post is not None and post["condition"]
+    else:
+        assert (post is not None) is postheat
+        assert post is None or post["condition"] is None
+    assert result["pwht"]["required"] is pwht_required
+
+
+def test_unknown_carbon_asks_for_carbon_content():
+    reply = rules.answer('P-No.4 NPS 8" 12mm PWHT')
+    assert "PWHT：不需要" not in reply
+    assert "含碳量" in reply
+
+
+@pytest.mark.parametrize("question", [
+    "碳鋼 25mm 硬度試驗怎麼做",  # 沒有問預熱、後熱或 PWHT
+    "P-No.9A 20mm 預熱",        # 規則表沒有的 P-Number
+    "P-No.6 20mm PWHT",         # 只有預熱表有，PWHT 表沒有
+    "P-No.15 20mm 預熱",
+    "預熱溫度是多少",             # 沒有 P-Number 與厚度
+])
+def test_answer_defers_to_spec_search(question):
+    assert rules.answer(question) is None
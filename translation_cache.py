@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from spec_index import normalize_text
+
+
+# 翻譯快取：以正規化後的問題為 key，LRU 上限 + TTL，可選擇寫入 SQLite 以便重啟後沿用；
+# 記憶體中沒有時會再查 SQLite，多個 worker 共用同一個檔案時可以讀到其他 worker 寫入的翻譯
+class TranslationCache:
+    def __init__(self, max_entries=2000, ttl_seconds=7 * 24 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # {key: (created, translation)}
+        self._lock = Lock()
+        self._db = None
+        self._pid = os.getpid()
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS translations "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                self._db.commit()
+                self._load()
+            except sqlite3.Error as e:
+                print(f"❌ 翻譯快取檔案無法使用，改用記憶體快取：{e}")
+                self._db = None
+
+    def _load(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._db.execute("DELETE FROM translations WHERE created < ?", (cutoff,))
+        self._db.execute(
+            "DELETE FROM translations WHERE key NOT IN "
+            "(SELECT key FROM translations ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, value, created FROM translations ORDER BY created DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, value, created in reversed(rows):
+            self._items[key] = (created, value)
+        print(f"✅ 載入 {len(self._items)} 筆翻譯快取")
+
+    # fork 出來的 worker 不能沿用父 process 的連線，重新開啟（呼叫時須持有 _lock）
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, query):
+        key = normalize_text(query)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.time() - item[0] <= self.ttl_seconds:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            if self._db is not None:
+                try:
+                    row = self._connection().execute(
+                        "SELECT value, created FROM translations WHERE key = ? AND created >= ?",
+                        (key, time.time() - self.ttl_seconds)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"❌ 翻譯快取讀取失敗：{e}")
+                    row = None
+                if row is not None:
+                    self._items[key] = (row[1], row[0])
+                    while len(self._items) > self.max_entries:
+                        self._items.popitem(last=False)
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, query, translation):
+        key = normalize_text(query)
+        created = time.time()
+        with self._lock:
+            self._items[key] = (created, translation)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+            if self._db is not None:
+                try:
+                    db = self._connection()
+                    db.execute(
+                        "INSERT OR REPLACE INTO translations (key, value, created) VALUES (?, ?, ?)",
+                        (key, translation, created)
+                    )
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"❌ 翻譯快取寫入失敗：{e}")
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
@@ -1,23 +1,88 @@
-from flask import Flask, request, jsonify
-from fuzzywuzzy import fuzz
+import time
+BOOT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify
 import os
-from openai import OpenAI
-import json
+import hmac
 import re
-from datetime import datetime, timedelta
-from threading import Thread
-import requests
+from datetime import timedelta
+from functools import partial, wraps
+import signal
+import sys
+from spec_index import SpecResultStore, resolve_ref
+from knowledge import SNAPSHOT_PATH, KnowledgeBase
+from translation_cache import TranslationCache
+from spec_summaries import SUMMARY_MIN_CHARS, SpecSummaries, summarize_section
+from worker_pool import BoundedExecutor
+from answer_cache import AnswerCache
+from pipe_classes import PipeClassLibrary
+import heat_treatment_rules
+import glossary
+from deadline import DEFAULT_BUDGET_SECONDS, Deadline, wait_within
+from session_store import create_session_store
+from history_manager import HistoryManager
+import http_client
+import metrics
+from http_client import chat_completion, chat_completion_stream
+from line_delivery import delivery, push_texts, stream_to_line
+
+# 冷啟動各階段耗時（ms），啟動完成時印出，/ready 也會回傳
+startup_phases = {}
+_phase_started = BOOT_STARTED
+
+
+def mark_startup_phase(name):
+    global _phase_started
+    now = time.perf_counter()
+    startup_phases[name] = round((now - _phase_started) * 1000, 1)
+    _phase_started = now
+
+
+mark_startup_phase("imports")
 
-# 儲存使用者對話歷史，格式為 {session_id: {"messages": [...], "last_seen": datetime}}
-session_histories = {}
-MAX_HISTORY = 5  # 最多紀錄 5 輪（user + assistant）
 SESSION_TIMEOUT = timedelta(minutes=5)
+# 儲存使用者對話歷史（依 SESSION_STORE 選擇記憶體或 SQLite），逾時與超量的 session 由背景定期清除
+session_store = create_session_store(ttl_seconds=SESSION_TIMEOUT.total_seconds())
+# 對話歷史以 token 計算：最近的對話原文保留在預算內，較早的對話併入滾動摘要
+history_manager = HistoryManager(
+    budget_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", 1500)),
+    summary_tokens=int(os.getenv("HISTORY_SUMMARY_TOKENS", 300))
+)
+
+# 規範查詢結果：最多保留前 30 筆，每頁顯示 5 筆，其餘留在伺服器端供「更多」翻頁
+SPEC_MAX_RESULTS = 30
+SPEC_PAGE_SIZE = 5
+SPEC_MORE_KEYWORDS = {"更多", "more", "下一頁", "下一页"}
+spec_result_sets = SpecResultStore()
 
 app = Flask(__name__)
 
-# 設置 OpenAI API 密鑰
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+# GPT 背景工作池：限制同時執行的 GPT 呼叫數與排隊數量，滿了就請使用者稍後再試
+gpt_executor = BoundedExecutor(
+    max_workers=int(os.getenv("GPT_WORKERS", 8)),
+    max_queue=int(os.getenv("GPT_QUEUE_SIZE", 32)),
+    name="gpt"
+)
+metrics.register_executor(gpt_executor)
+BUSY_REPLY = "⚠️ 目前詢問的人較多，請稍後幾分鐘再試一次。"
+# GPT 回答以串流方式產生，邊生成邊分段推播到 LINE（設為 0 則等完整回答再一次推播）
+GPT_STREAMING = os.getenv("GPT_STREAMING", "1") != "0"
+# Dialogflow 的 LINE 整合會用 reply token 送出 webhook 回覆的 fulfillmentText；設為 1 時，
+# 需要背景處理的問題不回覆「思考中」，把 reply token 留給背景回答（期限內完成就以不計額度的 Reply API 送出）
+# 開啟前須清空相關 intent 在 Dialogflow 上設定的預設回應，否則 Dialogflow 會改送出預設回應
+LINE_REPLY_TOKEN_DELIVERY = os.getenv("LINE_REPLY_TOKEN_DELIVERY", "0") == "1"
+metrics.REGISTRY.callback(
+    "webhook_line_delivery_total", "LINE 傳送統計：API 呼叫、reply、重試、合併送出與失敗次數", ("kind",),
+    lambda: {(kind,): value for kind, value in delivery.stats().items() if kind not in ("queued", "reply_tokens")},
+    kind="counter"
+)
+
+# 每個 webhook 請求可同步處理的時間；超過就先回覆「處理中」，結果改由 LINE 推播
+WEBHOOK_BUDGET_SECONDS = float(os.getenv("WEBHOOK_BUDGET_SECONDS", DEFAULT_BUDGET_SECONDS))
+
+# 設置 OpenAI API 密鑰（實際呼叫皆透過 http_client 的共用連線池）
+OPENAI_API_KEY = http_client.OPENAI_API_KEY
+LINE_CHANNEL_ACCESS_TOKEN = http_client.LINE_CHANNEL_ACCESS_TOKEN
 
 # 上傳 PDF 檔案至 OpenAI
 # with open(r"C:\Users\N000135995\Documents\Class Index1.pdf", "rb") as f:
@@ -25,8 +90,8 @@ LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 
 # file_id = upload_response.id
 
-if client.api_key:
-    print("✅ 成功抓到 OPENAI_API_KEY:", client.api_key[:5] + "...")
+if OPENAI_API_KEY:
+    print("✅ 成功抓到 OPENAI_API_KEY:", OPENAI_API_KEY[:5] + "...")
 else:
     print("❌ 沒有找到 OPENAI_API_KEY")
     
@@ -35,71 +100,112 @@ if LINE_CHANNEL_ACCESS_TOKEN:
 else:
     print("❌ 沒有找到 LINE_CHANNEL_ACCESS_TOKEN")
 
-# 載入 TYPE 和連結的對應關係
-try:
-    with open("links.json", "r", encoding="utf-8") as f:
-        type_links = json.load(f)
-except UnicodeDecodeError as e:
-    print(f"讀取 links.json 時發生編碼錯誤：{e}")
-    type_links = {}
-
-# 載入配管試壓規範 JSON
-try:
-    with open("piping_specification.json", "r", encoding="utf-8") as f:
-        piping_specification = json.load(f)
-except FileNotFoundError:
-    piping_specification = {}
-    print("❌ 無法找到配管規範 JSON 檔案。")
-
-try:
-    with open("piping_heat_treatment.json", "r", encoding="utf-8") as f:
-        piping_heat_treatment = json.load(f)
-except FileNotFoundError:
-    piping_heat_treatment = {}
-    print("❌ 無法找到熱處理規範 JSON 檔案。")
+# 規範 JSON、type_links 與搜尋索引：啟動時載入，檔案更新後由背景監看重新建立索引並整份換上
+# （每 KNOWLEDGE_RELOAD_INTERVAL 秒檢查一次，0 為關閉）；各 handler 透過 ctx.knowledge 取用該請求開始時的版本
+# 有預先建好的索引快照（python knowledge.py）就直接載入，否則由 JSON 建立
+knowledge_base = KnowledgeBase(
+    federated_workers=int(os.getenv("FEDERATED_SEARCH_WORKERS", 1)),
+    watch_interval=float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", 30)),
+    snapshot_path=os.getenv("KNOWLEDGE_SNAPSHOT_PATH", SNAPSHOT_PATH) or None
+)
+mark_startup_phase("knowledge")
+# 設定後可用 POST /admin/reload（Authorization: Bearer <ADMIN_TOKEN>）立即重新載入
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# 長章節的預先摘要（由 python spec_summaries.py 批次產生）
+spec_summaries = SpecSummaries()
+
+# 翻譯快取：同樣的問題不必每次都呼叫 GPT 翻譯（設定 TRANSLATION_CACHE_PATH="" 可關閉檔案保存）
+translation_cache = TranslationCache(
+    max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 2000)),
+    ttl_seconds=int(os.getenv("TRANSLATION_CACHE_TTL", 7 * 24 * 3600)),
+    path=os.getenv("TRANSLATION_CACHE_PATH", "translation_cache.db") or None
+)
+
+# 已轉檔的管線等級表（由 python pipe_classes.py 產生），有資料的等級只送出該等級內容
+pipe_class_library = PipeClassLibrary()
+
+# 管線等級 GPT 回答快取：同一題、同一份 PDF 直接沿用先前的回答，並合併同時進來的相同問題
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 500)),
+    ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))
+)
+mark_startup_phase("caches")
 
 #問題中文轉英文
 def translate_to_english(query):
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "請將下面的中文工程問題翻譯為簡潔精確的英文，供資料比對使用。"},
-            {"role": "user", "content": query}
-        ],
-        temperature=0.2
-    )
-    return response.choices[0].message.content.strip()
+    cached = translation_cache.get(query)
+    metrics.CACHE_REQUESTS.inc(cache="translation", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    with metrics.stage_timer("translate"):
+        translation = chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "請將下面的中文工程問題翻譯為簡潔精確的英文，供資料比對使用。"},
+                {"role": "user", "content": query}
+            ],
+            temperature=0.2
+        )
+    translation_cache.put(query, translation)
+    return translation
 
-def search_piping_spec(question, spec_data, keywords, threshold=70):
+def search_piping_spec(question, spec_index, keywords, threshold=70, top_k=SPEC_MAX_RESULTS):
     if question.startswith("PCQ-"):
         question = question.replace("PCQ-", "", 1)
-    question_cleaned = re.sub(r"\s+", "", question).lower()
-
-    matched_summaries = []
-    matched_details = {}
-    total_matches = 0
-
-    for chapter, data in spec_data.items():
-        title = data.get("title", "")
-        content = data.get("content", {})
 
-        for sec_num, sec_text in content.items():
-            text_clean = re.sub(r"\s+", "", sec_text).lower()
-
-            # 模糊比對分數
-            score = fuzz.partial_ratio(question_cleaned, text_clean)
-
-            if score >= threshold:
-                key = f"第{chapter}章 {title} - {sec_num}"
-                matched_summaries.append(key)
-                matched_details[key] = sec_text
-                total_matches += 1
-
-    if matched_summaries:
-        summary = "\n".join([f"{i+1}. {s}" for i, s in enumerate(matched_summaries)])
-        return summary, matched_details, total_matches
-
-    return "查無相關內容。", {}, 0
+    with metrics.stage_timer("search"):
+        return spec_index.search(question, top_k=top_k, threshold=threshold)
+
+# 本地查詢：先以原句比對，查不到時用詞彙表把中文轉成英文查詢（毫秒級），仍查不到才需要 GPT 翻譯
+# 回傳 (hits, expansion)；expansion 為 None 代表詞彙表無法辨識這句話
+def local_spec_search(question, spec_index, keywords):
+    hits = search_piping_spec(question, spec_index, keywords)
+    if hits:
+        return hits, None
+    expansion = glossary.expand(question)
+    if expansion is None:
+        return [], None
+    print(f"📖 詞彙表轉換：{expansion.bilingual}")
+
+    # 先查整句英文，結果不足一頁時再以個別詞彙補充，排在整句命中之後；同一章節保留最好的排名
+    # 以排名層級區分而不扣分：聯合索引的分數已換算成 0~1，扣分會變成負數
+    # 中英並列（expansion.bilingual）只用於紀錄：實測常見問題以它查詢沒有比英文查詢多找到任何章節
+    merged = {}
+    for i, variant in enumerate(expansion.variants):
+        if i and len(merged) >= SPEC_PAGE_SIZE:
+            break
+        tier = 1 if i else 0
+        for score, entry in search_piping_spec(variant, spec_index, None):
+            ref = spec_index.ref(entry)
+            if ref not in merged or (tier, -score) < merged[ref][:2]:
+                merged[ref] = (tier, -score, score, entry)
+    ranked = sorted(merged.values(), key=lambda item: item[:2])[:SPEC_MAX_RESULTS]
+    return [(score, entry) for _, _, score, entry in ranked], expansion
+
+# 產生某一頁的查詢結果回覆與 spec-context 參數
+# context 只放章節參照，內文在選擇時再從記憶體中的索引取出
+# 另外記下查詢字串與語料庫，換到別的 worker process 時仍可重新查出同一組結果
+def build_spec_page(hits, offset, spec_type_desc, spec_index, query):
+    page = hits[offset:offset + SPEC_PAGE_SIZE]
+    summary = "\n".join([f"{offset + i + 1}. {entry.label}" for i, (_, entry) in enumerate(page)])
+    reply = f"根據《{spec_type_desc}》，找到 {len(hits)} 筆相關內容"
+    if len(hits) > SPEC_PAGE_SIZE:
+        reply += f"（第 {offset + 1}~{offset + len(page)} 筆）"
+    reply += f"：\n{summary}\n請輸入對應的項目編號查看詳細內容（例如輸入 {offset + 1}）"
+    if offset + len(page) < len(hits):
+        reply += "\n輸入「更多」查看其他結果"
+
+    params = {
+        "await_spec_selection": True,
+        "spec_query": query,
+        "spec_corpus": spec_index.name,
+        "spec_desc": spec_type_desc,
+        "spec_offset": offset,
+        "spec_refs": [spec_index.ref(entry) for _, entry in page]
+    }
+    return reply, params
 
 #LINE 按鈕程式
 def payload_with_buttons(text, options):    
@@ -154,556 +260,645 @@ def extract_from_query(text):
         found["action"] = "詢問內容"
 
     return found
-       # 讀取 context 中的參數
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    req = request.get_json()
-    if not isinstance(req, dict):
-        print(f"❌ 錯誤：req 不是字典，而是 {type(req)}")
-        return jsonify({"fulfillmentText": "請求格式錯誤，請確保 Content-Type 為 application/json。"}) 
-    
-    user_id = (
-        req.get("originalDetectIntentRequest", {})
-        .get("payload", {})
-        .get("data", {})
-        .get("source", {})  # ← 這裡取出 dict
-        .get("userId")      # ← 再從 dict 中取出 userId 字串
-        or
-        req.get("originalDetectIntentRequest", {})
-        .get("payload", {})
-        .get("data", {})
-        .get("events", [{}])[0]
-        .get("source", {})
-        .get("userId")
-    )
+# 預先編譯的代碼比對 pattern
+# 管線等級：1~2 個英文字母 + 數字 + 可選的英數尾碼（如 A012、A144N、T810-OL）
+GRADE_CODE_RE = re.compile(r"\b([A-Z]{1,2}\d{0,4}[A-Z0-9\-]*)\b")
+# 管支撐：TYPE 編號與 M 編號
+SUPPORT_M_HINT_RE = re.compile(r"M[-\s]*\d+")
+SUPPORT_TYPE_RE = re.compile(r"(?:TY(?:PE)?)[-\s]*0*(\d{1,3}[A-Z]?)")
+SUPPORT_M_RE = re.compile(r"(?:管支撐\s*)?M[-\s]*0*(\d{1,2}[A-Z]?)")
+
+RESET_COMMANDS = frozenset(["重新開始", "reset", "重設對話", "重新來"])
+RESET_REPLY = "✅ 對話已重置，請重新輸入您想查詢的規範或問題。"
+GPT_ERROR_REPLY = "抱歉，目前無法處理您的請求，請稍後再試。"
+THINKING_REPLY = "🧠 我正在思考中，請稍後幾秒..."
+PROCESSING_REPLY = "⏳ 查詢需要較長時間，完成後會再傳送結果給您..."
+
+# 管線等級 PDF：預設使用煉油部，問題開頭為「烯烴」時改用烯烴部
+# GPT-4o 回答參數（也是回答快取 key 的一部分）
+GPT_ANSWER_PARAMS = {"model": "gpt-4o", "max_tokens": 800, "temperature": 0.4, "top_p": 1}
+REFINERY_FILE_ID = "file-Rx9uVCDFeBVp5sb7uC9VKU"
+OLEFIN_FILE_ID = "file-1bizvwrRLzjVXNfwLoctAb"  # 🔁 改成你實際的烯烴 file ID
+PIPE_CLASS_FILE_IDS = {"refinery": REFINERY_FILE_ID, "olefin": OLEFIN_FILE_ID}
+
+SYSTEM_PROMPT = """
+你是配管設計專家，具有十年以上工業配管、設備及鋼構設計經驗，熟悉ASME、JIS、API等相關標準與施工規範。
+回答時請保持專業且簡潔明瞭，避免過度冗長。
+回答內容須具體且技術性強，並以正式且禮貌的語氣回覆。
+如果問題超出規範範圍，請禮貌告知並建議相關查詢方向。
+請避免提供與工程設計無關的資訊。
+請在回答中盡量包含標準編號、法規條文或標準圖引用。
+若使用專有名詞，請適當解釋以確保清晰易懂。
+"""
+
+
+# 回答改由背景送出時的確認訊息；開啟 LINE_REPLY_TOKEN_DELIVERY 時不回覆，reply token 留給背景回答
+def background_ack(ctx, text):
+    if LINE_REPLY_TOKEN_DELIVERY and ctx.reply_token and ctx.user_id:
+        delivery.hold_reply_token(ctx.user_id, ctx.reply_token)
+        return {}
+    return {"fulfillmentText": text}
+
+
+# 單次 webhook 請求解析後的資料
+class WebhookContext:
+    __slots__ = ("req", "user_id", "reply_token", "user_query", "session", "intent", "context_params", "deadline",
+                 "knowledge")
+
+    def __init__(self, req):
+        self.deadline = Deadline(WEBHOOK_BUDGET_SECONDS)
+        self.knowledge = knowledge_base.snapshot()
+        self.req = req
+        data = req.get("originalDetectIntentRequest", {}).get("payload", {}).get("data", {})
+        self.user_id = (
+            data.get("source", {}).get("userId")
+            or (data.get("events") or [{}])[0].get("source", {}).get("userId")
+        )
+        self.reply_token = data.get("replyToken") or (data.get("events") or [{}])[0].get("replyToken")
 
-    # print(f"🔍 解析取得的 user_id: {user_id}")
-    
-    # if user_id:
-    #     push_to_line(user_id, "這是從 GPT 主動推播給您的訊息")
-    # else:
-    #     print("❌ 無法取得使用者 ID，推播失敗")
-
-    query_result = req.get("queryResult", {})
-    user_query = query_result.get("queryText", "")
-    session = req.get("session", "")
-    intent = req.get("queryResult", {}).get("intent", {}).get("displayName", "")
-
-    # 讀取 context 中的參數
-    context_params = {}
-    for context in req.get("queryResult", {}).get("outputContexts", []):
-        if "spec-context" in context.get("name", ""):
-            context_params = context.get("parameters", {})
-
-    def output_context(params):
+        query_result = req.get("queryResult", {})
+        self.user_query = query_result.get("queryText", "")
+        self.session = req.get("session", "")
+        self.intent = query_result.get("intent", {}).get("displayName", "")
+
+        # 讀取 context 中的參數
+        self.context_params = {}
+        for context in query_result.get("outputContexts", []):
+            if "spec-context" in context.get("name", ""):
+                self.context_params = context.get("parameters", {})
+
+    def output_context(self, params):
         if not params or params.get("await_spec_selection") is False:
             # 清除上下文
             return [{
-                "name": f"{session}/contexts/spec-context",
+                "name": f"{self.session}/contexts/spec-context",
                 "lifespanCount": 0,  # 設置 lifespanCount 為 0 清除上下文
                 "parameters": {}
             }]
-        else:
-            # 保留上下文
-            return [{
-                "name": f"{session}/contexts/spec-context",
-                "lifespanCount": 5,  # 設置上下文的有效期
-                "parameters": params
-            }]
-   
-    def generate_spec_reply(user_query, spec_data, spec_type_desc):
-        keywords = {"規範", "資料", "標準圖", "查詢", "我要查", "查"}
+        # 保留上下文
+        return [{
+            "name": f"{self.session}/contexts/spec-context",
+            "lifespanCount": 5,  # 設置上下文的有效期
+            "parameters": params
+        }]
+
+
+# 各 handler 的執行時間記錄在 webhook_handler_seconds（/metrics）
+def timed_handler(name, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.HANDLER_SECONDS.observe(elapsed, handler=name)
+            print(f"⏱️ {name} {elapsed * 1000:.1f} ms")
+    return wrapper
+
+
+# 路由表：intent 名稱 → handler；context 旗標 → handler（Default Fallback Intent 時依序檢查）
+INTENT_HANDLERS = {}
+CONTEXT_HANDLERS = {}
+CONTEXT_FLAG_PRIORITY = (
+    "await_heat_question",
+    "await_pipecommon_question",
+    "await_pipinclass_download",
+    "await_support_code",
+    "await_pipeclass_question",
+)
+
+
+def intent_handler(name):
+    def register(fn):
+        INTENT_HANDLERS[name] = timed_handler(f"intent:{name}", fn)
+        return fn
+    return register
+
+
+def context_handler(flag):
+    def register(fn):
+        CONTEXT_HANDLERS[flag] = timed_handler(f"context:{flag}", fn)
+        return fn
+    return register
+
+
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    started = time.perf_counter()
+    metrics.set_intent("")
+    with metrics.stage_timer("parse"):
+        req = request.get_json(silent=True)
+    if not isinstance(req, dict):
+        print(f"❌ 錯誤：req 不是字典，而是 {type(req)}")
+        return jsonify({"fulfillmentText": "請求格式錯誤，請確保 Content-Type 為 application/json。"})
+
+    ctx = WebhookContext(req)
+    # 沒有註冊的 intent 一律記為 other，避免指標標籤無限增加
+    metrics.set_intent(ctx.intent if ctx.intent in INTENT_HANDLERS else "other")
+    try:
+        return jsonify(dispatch(ctx))
+    finally:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, intent=metrics.current_intent())
+
 
-        summary, matched_details, total_matches = search_piping_spec(user_query, spec_data, keywords)
+def dispatch(ctx):
+    # 等待使用者選擇規範項目時，不論 intent 為何都先處理選擇
+    if ctx.context_params.get("await_spec_selection"):
+        reply = handle_spec_selection_timed(ctx)
+        if reply is not None:
+            return reply
 
-        if total_matches == 0:
-            english_query = translate_to_english(user_query)
-            summary, matched_details, total_matches = search_piping_spec(english_query, spec_data, keywords)
+    handler = INTENT_HANDLERS.get(ctx.intent, handle_default_timed)
+    return handler(ctx)
 
-        if total_matches > 0:
-            reply = f"根據《{spec_type_desc}》，找到 {total_matches} 筆相關內容：\n{summary}\n請輸入對應的項目編號查看詳細內容（例如輸入 1）"
-            
-            context = {
+
+def generate_spec_reply(ctx, spec_index, spec_type_desc):
+    keywords = {"規範", "資料", "標準圖", "查詢", "我要查", "查"}
+
+    # 本機模糊比對與詞彙表轉換都很快，直接同步處理
+    hits, expansion = local_spec_search(ctx.user_query, spec_index, keywords)
+    if hits:
+        spec_result_sets.put(ctx.session, hits, spec_type_desc, spec_index)
+        reply, params = build_spec_page(hits, 0, spec_type_desc, spec_index, ctx.user_query)
+        return {
+            "fulfillmentText": reply,
+            "outputContexts": ctx.output_context(params)
+        }
+
+    # 需要翻譯或 GPT 的慢速流程交給背景執行，在期限內完成就直接回覆，否則改用推播
+    spec_result_sets.discard(ctx.session)
+    # 詞彙表認得的問題翻成英文也查不到，不必再請 GPT 翻譯
+    future = gpt_executor.submit(resolve_spec_query, ctx.user_query, spec_index, spec_type_desc, ctx.session,
+                                 expansion is None)
+    if future is None:
+        return {"fulfillmentText": BUSY_REPLY}
+
+    done, result = wait_within(ctx.deadline, future, partial(push_background_reply, ctx.user_id))
+    if not done:
+        print("⏳ 規範查詢超過時間預算，改由背景完成後推播")
+        # 保留原本的 context（例如熱處理、共同規範模式），背景改由 GPT 回答時下一句仍照原模式處理
+        # 同時記下查詢字串與語料庫，清單由其他 worker 收到選擇時可重新查出
+        return {
+            "fulfillmentText": PROCESSING_REPLY,
+            "outputContexts": ctx.output_context({
+                **ctx.context_params,
                 "await_spec_selection": True,
-                "spec_options": list(matched_details.items())
-            }
+                "spec_pending": True,
+                "spec_query": ctx.user_query,
+                "spec_corpus": spec_index.name,
+                "spec_desc": spec_type_desc,
+                "spec_offset": 0,
+                "spec_refs": []
+            })
+        }
+
+    reply, params = result
+    if params:
+        return {"fulfillmentText": reply, "outputContexts": ctx.output_context(params)}
+    return {"fulfillmentText": reply}
+
+
+# 本機比對沒有結果時的慢速流程：翻譯成英文再比對，仍無結果則由 GPT 回答
+# 回傳 (回覆文字, spec-context 參數或 None)
+def resolve_spec_query(user_query, spec_index, spec_type_desc, session, translate=True):
+    hits = []
+    if translate:
+        try:
+            search_query = translate_to_english(user_query)
+            hits = search_piping_spec(search_query, spec_index, None)
+        except Exception as e:
+            print("❌ 翻譯失敗:", e)
+
+    if hits:
+        spec_result_sets.put(session, hits, spec_type_desc, spec_index)
+        return build_spec_page(hits, 0, spec_type_desc, spec_index, search_query)
+
+    try:
+        print("🔍 呼叫 GPT 回答...")
+        with metrics.stage_timer("gpt"):
+            reply = chat_completion(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "你是配管設計專家，只回答與配管規範相關的問題。"},
+                    {"role": "user", "content": user_query}
+                ],
+                max_tokens=350,
+                temperature=0.4,
+                top_p=1
+            )
+    except Exception as e:
+        print("❌ GPT 呼叫失敗:", e)
+        reply = GPT_ERROR_REPLY
+    return reply, None
+
 
+# 超過時間預算的工作完成後，把結果推播給使用者；結果可為文字或 (文字, context 參數)
+def push_background_reply(user_id, future):
+    try:
+        result = future.result()
+        reply = result[0] if isinstance(result, tuple) else result
+    except Exception as e:
+        print("❌ 背景處理失敗:", e)
+        reply = GPT_ERROR_REPLY
+    if not user_id:
+        print("❌ 無法取得使用者 ID，背景結果無法推播")
+        return
+    push_to_line(user_id, reply)
+
+
+def summarize_and_store(content):
+    with metrics.stage_timer("summarize"):
+        summary = summarize_section(content)
+    spec_summaries.put(content, summary)
+    return summary
+
+
+# 查詢結果不在這個 process 的暫存中（例如由其他 worker 產生）時，依 context 記下的查詢字串重新查詢
+# 只查本機索引與翻譯快取，不在請求中呼叫 GPT；查不到回傳 None
+def requery_result_set(ctx):
+    spec_index = ctx.knowledge.spec_indexes.get(ctx.context_params.get("spec_corpus"))
+    query = ctx.context_params.get("spec_query", "")
+    if spec_index is None or not query:
+        return None
+    hits, _ = local_spec_search(query, spec_index, None)
+    if not hits:
+        translation = translation_cache.get(query)
+        if translation:
+            hits = search_piping_spec(translation, spec_index, None)
+    if not hits:
+        return None
+    result_set = (hits, ctx.context_params.get("spec_desc", ""), spec_index)
+    spec_result_sets.put(ctx.session, *result_set)
+    return result_set
+
+
+def handle_spec_selection(ctx):
+    user_choice = ctx.user_query.strip()
+    spec_items = ctx.context_params.get("spec_refs", [])
+    spec_offset = int(ctx.context_params.get("spec_offset", 0))
+    expired = {
+        "fulfillmentText": "上下文已過期，請重新查詢。",
+        "outputContexts": ctx.output_context({})
+    }
+
+    # 查詢結果是在背景完成後推播的：從伺服器端暫存（或重新查詢）取出第一頁
+    # 背景流程沒有產生清單（例如由 GPT 直接回答）時，項目編號與「更多」回覆過期，其他句子照一般流程處理
+    if not spec_items and ctx.context_params.get("spec_pending"):
+        result_set = spec_result_sets.get(ctx.session) or requery_result_set(ctx)
+        if not result_set:
+            if user_choice.isdigit() or user_choice.lower() in SPEC_MORE_KEYWORDS:
+                return expired
+            return None
+        hits, _, spec_index = result_set
+        spec_items = [spec_index.ref(entry) for _, entry in hits[:SPEC_PAGE_SIZE]]
+
+    if not spec_items:
+        return expired
+
+    if user_choice.lower() in SPEC_MORE_KEYWORDS:
+        result_set = spec_result_sets.get(ctx.session) or requery_result_set(ctx)
+        next_offset = spec_offset + len(spec_items)
+        if not result_set:
+            return expired
+        hits, spec_type_desc, spec_index = result_set
+        if next_offset >= len(hits):
             return {
-                "fulfillmentText": reply,
-                "outputContexts": output_context({
-                    "await_spec_selection": True,
-                    "spec_options": list(matched_details.items())
-                })
+                "fulfillmentText": f"已經是最後一頁了，請輸入項目編號（{spec_offset + 1}~{next_offset}）查看詳細內容。"
             }
-        else:
+        reply, params = build_spec_page(hits, next_offset, spec_type_desc, spec_index,
+                                        ctx.context_params.get("spec_query", ""))
+        return {
+            "fulfillmentText": reply,
+            "outputContexts": ctx.output_context(params)
+        }
+
+    if not user_choice.isdigit():
+        return {"fulfillmentText": "請輸入項目編號（例如 1 或 2），以查看詳細內容。"}
+
+    index = int(user_choice) - 1 - spec_offset
+    if not 0 <= index < len(spec_items):
+        return {"fulfillmentText": f"請輸入有效的數字（例如 {spec_offset + 1}~{spec_offset + len(spec_items)}）"}
+
+    entry = resolve_ref(ctx.knowledge.spec_indexes, spec_items[index])
+    if entry is None:
+        return expired
+    title, content = entry.label, entry.text
+
+    # 判斷是否超過 300 字，若超過則優先使用預先產生的摘要，沒有才即時呼叫 GPT
+    summary = None
+    if len(content) > SUMMARY_MIN_CHARS:
+        summary = spec_summaries.get(content)
+        metrics.CACHE_REQUESTS.inc(cache="summary", result="miss" if summary is None else "hit")
+        if summary is None:
+            print("📄 內容超過 300 字且無預先摘要，呼叫 GPT 生成摘要中...")
+            future = gpt_executor.submit(summarize_and_store, content)
             try:
-                print("🔍 呼叫 GPT 回答...")
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "你是配管設計專家，只回答與配管規範相關的問題。"},
-                        {"role": "user", "content": user_query}
-                    ],
-                    max_tokens=350,
-                    temperature=0.4,
-                    top_p=1
-                )
-                reply = response.choices[0].message.content.strip()
+                # 超過時間預算就先回覆原文，摘要在背景完成後留給下次使用
+                done, summary = wait_within(ctx.deadline, future) if future else (False, None)
+                if not done:
+                    print("⏳ 摘要未在時間內完成，先回覆原文")
             except Exception as e:
-                print("❌ GPT 呼叫失敗:", e)
-                reply = "抱歉，目前無法處理您的請求，請稍後再試。"
+                print("❌ GPT 摘要失敗:", e)
 
-            return {
-                "fulfillmentText": reply
-            }
-    
-    if context_params.get("await_spec_selection"):
-        user_choice = user_query.strip()
-        spec_items = context_params.get("spec_options", [])
-
-        if not spec_items:
-            return jsonify({
-                "fulfillmentText": "上下文已過期，請重新查詢。",
-                "outputContexts": output_context({})
-            })
+    if summary:
+        reply_text = f"📘 您選擇的是：{title}\n\n📌 **重點整理：**\n{summary}\n\n📄 **原始內容如下：**\n{content}"
+    else:
+        reply_text = f"📘 您選擇的是：{title}\n內容如下：\n{content}"
 
-        if user_choice.isdigit():
-            index = int(user_choice) - 1
-            if 0 <= index < len(spec_items):
-                title, content = spec_items[index]
-
-                # 判斷是否超過 300 字，若超過則呼叫 GPT 進行重點摘要
-                if len(content) > 300:
-                    try:
-                        print("📄 內容超過 300 字，呼叫 GPT 生成摘要中...")
-                        response = client.chat.completions.create(
-                            model="gpt-3.5-turbo",
-                            messages=[
-                                {"role": "system", "content": "你是配管設計專家，請將以下配管規範內容進行條列式重點整理，保留原意並清楚簡明。"},
-                                {"role": "user", "content": content}
-                            ],
-                            max_tokens=400,
-                            temperature=0.3,
-                            top_p=0.8
-                        )
-                        summary = response.choices[0].message.content.strip()
-                        reply_text = f"📘 您選擇的是：{title}\n\n📌 **重點整理：**\n{summary}\n\n📄 **原始內容如下：**\n{content}"
-                    except Exception as e:
-                        print("❌ GPT 摘要失敗:", e)
-                        reply_text = f"📘 您選擇的是：{title}\n內容如下：\n{content}"
-                else:
-                    reply_text = f"📘 您選擇的是：{title}\n內容如下：\n{content}"
-
-                return jsonify({
-                    "fulfillmentText": reply_text,
-                    "outputContexts": output_context({})  # 清除上下文
-                })
-            else:
-                return jsonify({
-                    "fulfillmentText": f"請輸入有效的數字（例如 1~{len(spec_items)}）"
-                })
-        else:
-            return jsonify({
-                "fulfillmentText": "請輸入項目編號（例如 1 或 2），以查看詳細內容。"
-            })
+    return {
+        "fulfillmentText": reply_text,
+        "outputContexts": ctx.output_context({})  # 清除上下文
+    }
 
-    if intent == "啟動管線熱處理規範問答模式":
-        return jsonify({
-            "fulfillmentText": ("請問您想詢問哪段熱處理規範內容？\n例如：預熱溫度、PWHT溫度、保溫時間、冷卻方式等。"),
-            "outputContexts": output_context({
-                "await_heat_question": True,                
-            })
-        })
-    elif intent == "請輸入管線等級名稱":
-        return jsonify({
-                "fulfillmentText": ("請輸入管線等級（如 A012、B012、A144N 等）以查詢對應連結。"),
-                "outputContexts": output_context({
-                "await_pipinclass_download": True,                
-            })
-        })
-
-    elif intent == "下載管線等級":
-        extracted_data = extract_from_query(user_query)
-        user_query = req.get("queryResult", {}).get("queryText", "").upper()
-    # 比對：1 個英文字母 + 3 位數字 + 可選的英文字母（如 A012、A144N）
-        # match = re.search(r"\b([A-Z]{1,2}\d{2,4}[A-Z]?)\b", user_query.upper())
-        match = re.search(r"\b([A-Z]{1,2}\d{0,4}[A-Z0-9\-]*)\b", user_query.upper())
-        if match:
-            grade_code = match.group(1)
-            if grade_code in type_links:
-                return jsonify({
-                    "fulfillmentText": f"這是管線等級 {grade_code} 的對應連結：\n{type_links[grade_code]}"
-                })
-            else:
-                return jsonify({
-                    "fulfillmentText": f"找不到管線等級 {grade_code} 的連結，請確認是否輸入正確。"
-                })
-        else:
-            return jsonify({
-                "fulfillmentText": "請輸入正確的管線等級（如 A012、B012、A144N 等）以查詢對應連結。"
-            })
-        # return jsonify({
-        #     "fulfillmentText": spec_reply.get_json()["fulfillmentText"],
-        #     "outputContexts": output_context({
-        #         "await_heat_question": True,
-        #         "await_spec_selection": True
-        #     })
-        #})
-    # elif intent == "詢問配管共同要求規範內容":
-    #     print(f"🔍 Debug詢問配管共同要求規範內容: intent={intent}, user_query={user_query}, context_params={context_params}")
-    #     spec_reply = generate_spec_reply(user_query, piping_specification, "詢問配管共同要求規範內容")
-    #     return jsonify(spec_reply)
-    elif intent == "啟動配管共同要求規範問答模式":
-        return jsonify({
-            "fulfillmentText": ("請問您想詢問哪段配管共同要求規範內容"),
-            "outputContexts": output_context({
-                "await_pipecommon_question": True,                
-            })
-        })
-    
-    elif intent == "啟動詢問管線等級內容":
-        return jsonify({
-            "fulfillmentText": (
-                "(測試中)請輸入您想查詢的配管等級問題，例如：\n"
-                "🔹「A012 適用哪些流體？」（煉油部）\n"
-                "🔹「烯烴-A1D 適用哪些流體？」（烯烴部）\n"
-                "📌 烯烴部請加上「烯烴-」前綴，系統將自動辨識並查詢對應資料。"
-            ),
-            "outputContexts": output_context({
-                "await_pipeclass_question": True,                
-            })
-        })
-    
-    elif intent == "管支撐規範":
-        # 統一取得參數：優先從 query 抽出，否則使用 context 中值
-        extracted_data = extract_from_query(user_query)
-
-        # 檢查是否提到 TYPE 編號
-        user_query = user_query.upper()  # 預先轉大寫，提高效率
-
-        if "TY" in user_query or re.search(r"M[-\s]*\d+", user_query):
-            match_type = re.search(r"(?:TY(?:PE)?)[-\s]*0*(\d{1,3}[A-Z]?)", user_query.upper())
-            match_m = re.search(r"(?:管支撐\s*)?M[-\s]*0*(\d{1,2}[A-Z]?)", user_query.upper())
-
-            if match_type:
-                type_id = match_type.group(1)
-                
-                # 檢查是否有字母尾碼，並根據情況補零
-                if type_id[-1].isalpha():
-                    num_part = type_id[:-1].zfill(2) if type_id[:-1] else "00"
-                    alpha_part = type_id[-1]
-                    type_key = f"TYPE{num_part}{alpha_part}"
-                else:
-                    type_key = f"TYPE{type_id.zfill(2)}"
-
-                if type_key in type_links:
-                    return jsonify({
-                        "fulfillmentText": f"這是管支撐規範（塑化）{type_key} 的下載連結：\n{type_links[type_key]}"
-                    })
-                else:
-                    return jsonify({
-                        "fulfillmentText": f"找不到 {type_key} 的對應連結，請確認是否輸入正確。"
-                    })
-
-            elif match_m:
-                m_id = match_m.group(1)
-                
-                # 檢查是否有字母尾碼，並根據情況補零
-                if m_id[-1].isalpha():
-                    num_part = m_id[:-1].zfill(2) if m_id[:-1] else "00"
-                    alpha_part = m_id[-1]
-                    m_key = f"M{num_part}{alpha_part}"
-                else:
-                    m_key = f"M{m_id.zfill(2)}"
-
-                if m_key in type_links:
-                    return jsonify({
-                        "fulfillmentText": f"這是管支撐規範 {m_key} 的下載連結：\n{type_links[m_key]}"
-                    })
-                else:
-                    return jsonify({
-                        "fulfillmentText": f"找不到 {m_key} 的對應連結，請確認是否輸入正確。"
-                    })
-
-            else:
-                return jsonify({
-                    "fulfillmentText": "請輸入正確的管支撐型式編號（如 TYPE01 或 M01）以查詢規範連結。"
-                })
-
-    elif intent == "詢問管線等級問題回答":
-        
-        # 讀取歷史（若超過 SESSION_TIMEOUT 則重置）
-        now = datetime.now()
-        session_data = session_histories.get(session, {"messages": [], "last_seen": now})
-        if now - session_data["last_seen"] > SESSION_TIMEOUT:
-            session_data["messages"] = []
 
-        # ✅ 檢查是否要重設對話
-        if user_query.strip() in ["重新開始", "reset", "重設對話", "重新來"]:
-            session_data["messages"] = []
-            session_data["last_seen"] = now
-            session_histories[session] = session_data
-            return jsonify({"fulfillmentText": "✅ 對話已重置，請重新輸入您想查詢的規範或問題。"})
+handle_spec_selection_timed = timed_handler("context:await_spec_selection", handle_spec_selection)
 
-        history = session_data["messages"]
 
-        # 加入使用者輸入
-        history.append({"role": "user", "content": user_query})
+# 代碼找不到時附上相近代碼的 LINE 按鈕，並保留 context 讓使用者點選後直接查詢
+def code_suggestion_reply(ctx, text, suggestions, context_flag):
+    if not suggestions:
+        return {"fulfillmentText": text}
+    prompt = f"{text}\n您是不是要找：{'、'.join(suggestions)}"
+    return {
+        "fulfillmentText": prompt,
+        "fulfillmentMessages": [payload_with_buttons(prompt[:160], suggestions)],
+        "outputContexts": ctx.output_context({context_flag: True})
+    }
 
-        # 限制歷史長度
-        if len(history) > MAX_HISTORY * 2:
-            history = history[-MAX_HISTORY * 2:]
 
-        # 是否需要提醒
-        user_reminder = ""
-        if len(history) >= MAX_HISTORY * 2:
-            user_reminder = '⚠️ 您的對話已超過 5 輪，為保持效能，請輸入"重設對話"。\n\n'
+# 查詢管線等級下載連結（「下載管線等級」與 await_pipinclass_download 共用）
+def grade_code_reply(ctx):
+    match = GRADE_CODE_RE.search(ctx.user_query.upper())
+    if not match:
+        return {"fulfillmentText": "請輸入正確的管線等級（如 A012、B012、A144N 等）以查詢對應連結。"}
+
+    grade_code = match.group(1)
+    found = ctx.knowledge.code_index.lookup(grade_code)
+    if found:
+        return {"fulfillmentText": f"這是管線等級 {found[0]} 的對應連結：\n{found[1]}"}
+    return code_suggestion_reply(
+        ctx,
+        f"找不到管線等級 {grade_code} 的連結，請確認是否輸入正確。",
+        ctx.knowledge.code_index.suggest(grade_code),
+        "await_pipinclass_download"
+    )
 
-        session_data["messages"] = history
-        session_data["last_seen"] = now
-        session_histories[session] = session_data
 
-        system_prompt = """
-        你是配管設計專家，具有十年以上工業配管、設備及鋼構設計經驗，熟悉ASME、JIS、API等相關標準與施工規範。
-        回答時請保持專業且簡潔明瞭，避免過度冗長。
-        回答內容須具體且技術性強，並以正式且禮貌的語氣回覆。
-        如果問題超出規範範圍，請禮貌告知並建議相關查詢方向。
-        請避免提供與工程設計無關的資訊。
-        請在回答中盡量包含標準編號、法規條文或標準圖引用。
-        若使用專有名詞，請適當解釋以確保清晰易懂。
-        """
-        try:
-            reply = {"fulfillmentText": f"🧠 我正在思考中，請稍後幾秒..."}
+# 管支撐編號補零：「1」→「01」、「5A」→「05A」
+def support_code_key(prefix, code_id):
+    if code_id[-1].isalpha():
+        num_part = code_id[:-1].zfill(2) if code_id[:-1] else "00"
+        return f"{prefix}{num_part}{code_id[-1]}"
+    return f"{prefix}{code_id.zfill(2)}"
 
-            # 預設使用煉油部 file_id
-            file_id = "file-Rx9uVCDFeBVp5sb7uC9VKU"
 
-            # 若開頭為「烯烴」，切換為烯烴專用 file_id
-            if user_query.strip().startswith("烯烴"):
-                file_id = "file-1bizvwrRLzjVXNfwLoctAb"  # 🔁 改成你實際的烯烴 file ID
+# 查詢管支撐 TYPE / M 編號的下載連結（「管支撐規範」與 await_support_code 共用）
+def support_code_reply(ctx):
+    user_query = ctx.user_query.upper()
+    invalid = {"fulfillmentText": "請輸入正確的管支撐型式編號（如 TYPE01 或 M01）以查詢規範連結。"}
 
-            Thread(target=process_gpt_logic, args=(user_query, user_id, intent, history, file_id)).start()
-            
-            return jsonify(reply)
-        
-        except Exception as e:
-            print("❌ GPT 呼叫失敗:", e)
-            reply = "抱歉，目前無法處理您的請求，請稍後再試。"
-            return jsonify({
-                "fulfillmentText": reply
-            })
-   
-    elif intent == "設計問題集":
-
-            # 讀取歷史（若超過 SESSION_TIMEOUT 則重置）
-            now = datetime.now()
-            session_data = session_histories.get(session, {"messages": [], "last_seen": now})
-            if now - session_data["last_seen"] > SESSION_TIMEOUT:
-                session_data["messages"] = []
-
-            # ✅ 檢查是否要重設對話
-            if user_query.strip() in ["重新開始", "reset", "重設對話", "重新來"]:
-                session_data["messages"] = []
-                session_data["last_seen"] = now
-                session_histories[session] = session_data
-
-                reply = {
-                    "fulfillmentText": "✅ 對話已重置，請重新輸入您想查詢的規範或問題。",
-                }
-                return jsonify(reply)
+    if "TY" not in user_query and not SUPPORT_M_HINT_RE.search(user_query):
+        return invalid
 
-            history = session_data["messages"]
+    match_type = SUPPORT_TYPE_RE.search(user_query)
+    match_m = None if match_type else SUPPORT_M_RE.search(user_query)
+    if match_type:
+        prefix, key = "TYPE", support_code_key("TYPE", match_type.group(1))
+    elif match_m:
+        prefix, key = "M", support_code_key("M", match_m.group(1))
+    else:
+        return invalid
+
+    found = ctx.knowledge.code_index.lookup(key)
+    if found:
+        source = "（塑化）" if prefix == "TYPE" else " "
+        return {"fulfillmentText": f"這是管支撐規範{source}{found[0]} 的下載連結：\n{found[1]}"}
+
+    # 只建議同系列（TYPE 或 M）的代碼
+    suggestions = [code for code in ctx.knowledge.code_index.suggest(key, limit=8) if code.startswith(prefix)][:4]
+    return code_suggestion_reply(
+        ctx,
+        f"找不到 {key} 的對應連結，請確認是否輸入正確。",
+        suggestions,
+        "await_support_code"
+    )
 
-            # 加入使用者輸入
-            history.append({"role": "user", "content": user_query})
 
-            # 限制歷史長度
-            if len(history) > MAX_HISTORY * 2:
-                history = history[-MAX_HISTORY * 2:]
+# 讀取對話歷史並加入本輪問題；使用者要求重設時回傳 (None, 重設回覆)
+def prepare_history(ctx):
+    if ctx.user_query.strip() in RESET_COMMANDS:
+        session_store.clear(ctx.session)
+        return None, {"fulfillmentText": RESET_REPLY}
+
+    # 讀取歷史（若超過 SESSION_TIMEOUT 則為空），加入使用者輸入；摘要由背景 GPT 工作負責，這裡只做不呼叫 GPT 的上限
+    history = session_store.load(ctx.session)
+    history.append({"role": "user", "content": ctx.user_query})
+    history = history_manager.trim(history)
+    session_store.save(ctx.session, history)
+    return history, None
+
+
+# 回答完成後寫回歷史（背景工作或直接回覆皆同；history 最後一則是本輪的使用者問題）
+def save_reply(session, history, reply):
+    if session:
+        session_store.save(session, history + [{"role": "assistant", "content": reply}])
+
+
+# 管線等級問題：已轉檔的等級先嘗試直接查表，否則只把該等級的內容交給背景 GPT-4o；
+# 沒有轉檔資料時附上對應的整份 PDF。完成後以 LINE 推播回覆
+def submit_pipe_class_question(ctx, history):
+    corpus = "olefin" if ctx.user_query.strip().startswith("烯烴") else "refinery"
+    file_id, reference = PIPE_CLASS_FILE_IDS[corpus], None
+    code = pipe_class_library.find_code(corpus, ctx.user_query)
+    if code:
+        local_reply = pipe_class_library.local_answer(corpus, code, ctx.user_query)
+        if local_reply:
+            print(f"📋 直接查表回答 {code}")
+            save_reply(ctx.session, history, local_reply)
+            return {"fulfillmentText": local_reply}
+        file_id, reference = None, pipe_class_library.reference(corpus, code, ctx.user_query)
+
+    cache_key = pipe_class_cache_key(ctx, history, file_id or pipe_class_library.version(corpus, code))
+    if cache_key is not None:
+        cached = answer_cache.get(cache_key)
+        metrics.CACHE_REQUESTS.inc(cache="answer", result="miss" if cached is None else "hit")
+        if cached is not None:
+            print("✅ 使用快取的管線等級回答")
+            save_reply(ctx.session, history, cached)
+            return {"fulfillmentText": cached}
+        # 同一題已在查詢中（其他使用者或 Dialogflow 重送）：等結果出來再推播給這位使用者
+        if not answer_cache.begin(cache_key, ctx.user_id, partial(push_to_line, ctx.user_id)):
+            return background_ack(ctx, THINKING_REPLY)
+
+    if gpt_executor.submit(process_gpt_logic, ctx.user_query, ctx.user_id, ctx.intent, history, file_id, cache_key, ctx.session, reference) is None:
+        if cache_key is not None:
+            answer_cache.fail(cache_key, BUSY_REPLY)
+        return {"fulfillmentText": BUSY_REPLY}
+    return background_ack(ctx, THINKING_REPLY)
+
+
+# 只快取不依賴前文的問題：對話的第一句，或問題本身就指明了管線等級代碼；document 為 PDF 的 file_id 或等級內容版本
+def pipe_class_cache_key(ctx, history, document):
+    names_grade = any(ctx.knowledge.code_index.lookup(code) for code in GRADE_CODE_RE.findall(ctx.user_query.upper()))
+    if len(history) > 1 and not names_grade:
+        return None
+    return AnswerCache.make_key(ctx.user_query, document, GPT_ANSWER_PARAMS)
+
+
+@intent_handler("啟動管線熱處理規範問答模式")
+def handle_start_heat_mode(ctx):
+    return {
+        "fulfillmentText": "請問您想詢問哪段熱處理規範內容？\n例如：預熱溫度、PWHT溫度、保溫時間、冷卻方式等。",
+        "outputContexts": ctx.output_context({"await_heat_question": True})
+    }
 
-            # 是否需要提醒
-            user_reminder = ""
-            if len(history) >= MAX_HISTORY * 2:
-                user_reminder = '⚠️ 您的對話已超過 5 輪，為保持效能，請輸入"重設對話"。\n\n'
 
-            session_data["messages"] = history
-            session_data["last_seen"] = now
-            session_histories[session] = session_data
+@intent_handler("請輸入管線等級名稱")
+def handle_start_grade_download(ctx):
+    return {
+        "fulfillmentText": "請輸入管線等級（如 A012、B012、A144N 等）以查詢對應連結。",
+        "outputContexts": ctx.output_context({"await_pipinclass_download": True})
+    }
 
-            system_prompt = """
-            你是配管設計專家，具有十年以上工業配管、設備及鋼構設計經驗，熟悉ASME、JIS、API等相關標準與施工規範。
-            回答時請保持專業且簡潔明瞭，避免過度冗長。
-            回答內容須具體且技術性強，並以正式且禮貌的語氣回覆。
-            如果問題超出規範範圍，請禮貌告知並建議相關查詢方向。
-            請避免提供與工程設計無關的資訊。
-            請在回答中盡量包含標準編號、法規條文或標準圖引用。
-            若使用專有名詞，請適當解釋以確保清晰易懂。
-            """
 
-            try:
-                print("💬 使用 GPT 與對話歷史回答規範問題...")
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "system", "content": system_prompt}] + history,
-                    max_tokens=400,
-                    temperature=0.4,
-                    top_p=1,                                
-                    frequency_penalty=0.1,
-                    presence_penalty=0,
-                )
-                reply = user_reminder + response.choices[0].message.content.strip()
-
-                # 將 GPT 回答加入歷史
-                history.append({"role": "assistant", "content": reply})
-                session_data["messages"] = history
-                session_data["last_seen"] = now
-                session_histories[session] = session_data
+@intent_handler("下載管線等級")
+def handle_grade_download(ctx):
+    return grade_code_reply(ctx)
 
-            except Exception as e:
-                print("❌ GPT 呼叫失敗:", e)
-                reply = "抱歉，目前無法處理您的請求，請稍後再試。"
 
-            return jsonify({
-                "fulfillmentText": reply
-            })   
+@intent_handler("啟動配管共同要求規範問答模式")
+def handle_start_pipecommon_mode(ctx):
+    return {
+        "fulfillmentText": "請問您想詢問哪段配管共同要求規範內容",
+        "outputContexts": ctx.output_context({"await_pipecommon_question": True})
+    }
 
-    elif intent == "Default Fallback Intent":
 
-        # 讀取歷史（若超過 SESSION_TIMEOUT 則重置）
-        now = datetime.now()
-        session_data = session_histories.get(session, {"messages": [], "last_seen": now})
-        if now - session_data["last_seen"] > SESSION_TIMEOUT:
-            session_data["messages"] = []
+@intent_handler("啟動詢問管線等級內容")
+def handle_start_pipeclass_mode(ctx):
+    return {
+        "fulfillmentText": (
+            "(測試中)請輸入您想查詢的配管等級問題，例如：\n"
+            "🔹「A012 適用哪些流體？」（煉油部）\n"
+            "🔹「烯烴-A1D 適用哪些流體？」（烯烴部）\n"
+            "📌 烯烴部請加上「烯烴-」前綴，系統將自動辨識並查詢對應資料。"
+        ),
+        "outputContexts": ctx.output_context({"await_pipeclass_question": True})
+    }
 
-        # ✅ 檢查是否要重設對話
-        if user_query.strip() in ["重新開始", "reset", "重設對話", "重新來"]:
-            session_data["messages"] = []
-            session_data["last_seen"] = now
-            session_histories[session] = session_data
-            return jsonify({"fulfillmentText": "✅ 對話已重置，請重新輸入您想查詢的規範或問題。"})
 
-        history = session_data["messages"]
+@intent_handler("管支撐規範")
+def handle_pipe_support(ctx):
+    return support_code_reply(ctx)
 
-        # 加入使用者輸入
-        history.append({"role": "user", "content": user_query})
 
-        # 限制歷史長度
-        if len(history) > MAX_HISTORY * 2:
-            history = history[-MAX_HISTORY * 2:]
+@intent_handler("詢問管線等級問題回答")
+def handle_pipe_class_question(ctx):
+    history, reset_reply = prepare_history(ctx)
+    if reset_reply:
+        return reset_reply
+    return submit_pipe_class_question(ctx, history)
 
-        # 是否需要提醒
-        user_reminder = ""
-        if len(history) >= MAX_HISTORY * 2:
-            user_reminder = '⚠️ 您的對話已超過 5 輪，為保持效能，請輸入"重設對話"。\n\n'
 
-        session_data["messages"] = history
-        session_data["last_seen"] = now
-        session_histories[session] = session_data
+@intent_handler("設計問題集")
+def handle_design_questions(ctx):
+    history, reset_reply = prepare_history(ctx)
+    if reset_reply:
+        return reset_reply
 
-        system_prompt = """
-        你是配管設計專家，具有十年以上工業配管、設備及鋼構設計經驗，熟悉ASME、JIS、API等相關標準與施工規範。
-        回答時請保持專業且簡潔明瞭，避免過度冗長。
-        回答內容須具體且技術性強，並以正式且禮貌的語氣回覆。
-        如果問題超出規範範圍，請禮貌告知並建議相關查詢方向。
-        請避免提供與工程設計無關的資訊。
-        請在回答中盡量包含標準編號、法規條文或標準圖引用。
-        若使用專有名詞，請適當解釋以確保清晰易懂。
-        """
+    print("💬 使用 GPT 與對話歷史回答規範問題...")
+    future = gpt_executor.submit(answer_design_question, ctx.session, history)
+    if future is None:
+        return {"fulfillmentText": BUSY_REPLY}
 
-        # 處理特定上下文邏輯（熱處理、共同規範、管線等級）
-        if context_params.get("await_heat_question"):
-            print("🔄 重新路由到熱處理規範")
-            spec_reply = generate_spec_reply(user_query, piping_heat_treatment, "詢問熱處理規範")
-            return jsonify(spec_reply)
-
-        elif context_params.get("await_pipecommon_question"):
-            print("🔄 重新路由到配管共同規範")
-            spec_reply = generate_spec_reply(user_query, piping_specification, "詢問配管共同規範")
-            return jsonify(spec_reply)
-
-        elif context_params.get("await_pipinclass_download"):
-            extracted_data = extract_from_query(user_query)
-            user_query = req.get("queryResult", {}).get("queryText", "").upper()
-        # 比對：1 個英文字母 + 3 位數字 + 可選的英文字母（如 A012、A144N）
-            #match = re.search(r"\b([A-Z]{1,2}\d{2,4}[A-Z]?)\b", user_query.upper())
-            match = re.search(r"\b([A-Z]{1,2}\d{0,4}[A-Z0-9\-]*)\b", user_query.upper())
-            if match:
-                grade_code = match.group(1)
-                if grade_code in type_links:
-                    return jsonify({
-                        "fulfillmentText": f"這是管線等級 {grade_code} 的對應連結：\n{type_links[grade_code]}"
-                    })
-                else:
-                    return jsonify({
-                        "fulfillmentText": f"找不到管線等級 {grade_code} 的連結，請確認是否輸入正確。"
-                    })
-            else:
-                return jsonify({
-                    "fulfillmentText": "請輸入正確的管線等級（如 A012、B012、A144N 等）以查詢對應連結。"
-                })
-
-        # 🔁 處理其他規範問題
-        elif context_params.get("await_pipeclass_question"):
-            try:
-                reply = {"fulfillmentText": f"🧠 我正在思考中，請稍後幾秒..."}
+    done, reply = wait_within(ctx.deadline, future, partial(push_background_reply, ctx.user_id))
+    if not done:
+        return background_ack(ctx, PROCESSING_REPLY)
+    return {"fulfillmentText": reply}
 
-                # 預設使用煉油部 file_id
-                file_id = "file-Rx9uVCDFeBVp5sb7uC9VKU"
 
-                # 若開頭為「烯烴」，切換為烯烴專用 file_id
-                if user_query.strip().startswith("烯烴"):
-                    file_id = "file-1bizvwrRLzjVXNfwLoctAb"  # 🔁 改成你實際的烯烴 file ID
+def answer_design_question(session, history):
+    try:
+        history = history_manager.compact(history)
+        with metrics.stage_timer("gpt"):
+            reply = chat_completion(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "system", "content": SYSTEM_PROMPT}] + history,
+                max_tokens=400,
+                temperature=0.4,
+                top_p=1,
+                frequency_penalty=0.1,
+                presence_penalty=0,
+            )
+
+        # 將 GPT 回答加入歷史
+        save_reply(session, history, reply)
 
-                Thread(target=process_gpt_logic, args=(user_query, user_id, intent, history, file_id)).start()
-                
-                return jsonify(reply)
-            
-            except Exception as e:
-                print("❌ GPT 呼叫失敗:", e)
-                reply = "抱歉，目前無法處理您的請求，請稍後再試。"
-                return jsonify({
-                    "fulfillmentText": reply
-                })
-        else :
-            try:
-                print("💬 使用 GPT 與對話歷史回答規範問題...")
-                reply = {"fulfillmentText": f"🧠 我正在思考中，請稍後幾秒..."}
-                Thread(target=process_gpt_logic, args=(user_query, user_id, intent, history)).start()
-                return jsonify(reply)
-
-                # response = client.chat.completions.create(
-                #     model="gpt-4o",
-                #     messages=[
-                #         {"role": "system", "content": system_prompt},
-                #         {
-                #             "role": "user",
-                #             "content": [
-                #                 {"type": "text", "text": user_query},
-                #                 {"type": "file", "file": {"file_id": file_id}}
-                #             ]
-                #         }
-                #     ],
-                #     max_tokens=1000
-                # )
-            #     reply = user_reminder + response.choices[0].message.content.strip()
-
-            #     # 將 GPT 回答加入歷史
-            #     history.append({"role": "assistant", "content": reply})
-            #     session_data["messages"] = history
-            #     session_data["last_seen"] = now
-            #     session_histories[session] = session_data
+    except Exception as e:
+        print("❌ GPT 呼叫失敗:", e)
+        reply = GPT_ERROR_REPLY
 
-            except Exception as e:
-                print("❌ GPT 呼叫失敗:", e)
-                reply = "抱歉，目前無法處理您的請求，請稍後再試。"
+    return reply
+
+
+@intent_handler("Default Fallback Intent")
+def handle_fallback(ctx):
+    history, reset_reply = prepare_history(ctx)
+    if reset_reply:
+        return reset_reply
+
+    # 處理特定上下文邏輯（熱處理、共同規範、管線等級）
+    for flag in CONTEXT_FLAG_PRIORITY:
+        if ctx.context_params.get(flag):
+            return CONTEXT_HANDLERS[flag](ctx, history)
+
+    print("💬 使用 GPT 與對話歷史回答規範問題...")
+    if gpt_executor.submit(process_gpt_logic, ctx.user_query, ctx.user_id, ctx.intent, history, session=ctx.session) is None:
+        return {"fulfillmentText": BUSY_REPLY}
+    return background_ack(ctx, THINKING_REPLY)
+
+
+@context_handler("await_heat_question")
+def handle_heat_question(ctx, history):
+    # 問到預熱、後熱或 PWHT，且帶有規則表涵蓋的 P-Number（或材質）與厚度時直接由規則表回答
+    rule_reply = heat_treatment_rules.answer(ctx.user_query)
+    if rule_reply:
+        print("🔥 熱處理規則表直接回答")
+        return {"fulfillmentText": rule_reply, "outputContexts": ctx.output_context({"await_heat_question": True})}
+    print("🔄 重新路由到熱處理規範")
+    return generate_spec_reply(ctx, ctx.knowledge.piping_heat_treatment_index, "詢問熱處理規範")
+
+
+@context_handler("await_pipecommon_question")
+def handle_pipecommon_question(ctx, history):
+    print("🔄 重新路由到配管共同規範")
+    return generate_spec_reply(ctx, ctx.knowledge.piping_specification_index, "詢問配管共同規範")
+
+
+@context_handler("await_pipinclass_download")
+def handle_grade_download_context(ctx, history):
+    return grade_code_reply(ctx)
 
-            return jsonify({
-                "fulfillmentText": reply
-            })   
- 
-    else: 
-        return generate_spec_reply(user_query, piping_specification, "企業配管共同規範")
+
+@context_handler("await_support_code")
+def handle_support_code_context(ctx, history):
+    return support_code_reply(ctx)
+
+
+# 🔁 處理其他規範問題
+@context_handler("await_pipeclass_question")
+def handle_pipeclass_question_context(ctx, history):
+    return submit_pipe_class_question(ctx, history)
+
+
+# 其他未列在路由表的 intent：一次查詢所有本地語料（共同規範、熱處理規範、管線等級與標準圖代碼）
+def handle_default(ctx):
+    return generate_spec_reply(ctx, ctx.knowledge.federated_index, "配管規範與管線等級")
+
+
+handle_default_timed = timed_handler("intent:(default)", handle_default)
 
 
 # def process_gpt_logic(user_query, user_id, intent, history):
@@ -743,7 +938,7 @@ def webhook():
 #         print("❌ GPT 呼叫失敗:", e)
 #         push_to_line(user_id, "抱歉，目前無法處理您的請求，請稍後再試。")
 
-def process_gpt_logic(user_query, user_id, intent, history, file_id=None):
+def process_gpt_logic(user_query, user_id, intent, history, file_id=None, cache_key=None, session=None, reference=None):
     try:
         system_prompt = """
         你是配管設計專家，具有十年以上工業配管、設備及鋼構設計經驗，熟悉ASME、JIS、API等相關標準與施工規範。
@@ -757,61 +952,123 @@ def process_gpt_logic(user_query, user_id, intent, history, file_id=None):
         若資料不在PDF中，請明確告知；若沒有PDF，也請根據經驗或標準規範回答。
         """
 
-        # 建立 messages 並加入歷史訊息
+        # 建立 messages 並加入歷史訊息（超過 token 預算時較早的對話先併入摘要）
+        history = history_manager.compact(history)
         messages = [{"role": "system", "content": system_prompt}]
-        messages += history  # 對話歷史加進來
+        # 歷史最後一則就是本輪問題，下方會連同附件重新加入，不重複送出
+        if history and history[-1] == {"role": "user", "content": user_query}:
+            messages += history[:-1]
+        else:
+            messages += history
 
         # 建立使用者這一輪訊息
         user_message = [{"type": "text", "text": user_query}]
+        if reference:  # 已轉檔的管線等級：只附上該等級的內容
+            user_message.append({"type": "text", "text": "以下為相關的管線等級表內容，請依此回答：\n" + reference})
         if file_id:  # 若有檔案 ID 才加入
             user_message.append({"type": "file", "file": {"file_id": file_id}})
         
         messages.append({"role": "user", "content": user_message})
 
         # 呼叫 GPT-4o API
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-4o",
-                "messages": messages,
-                "max_tokens": 800,
-                "temperature": 0.4,
-                "top_p": 1
-            }
-        )
-
-        # 回覆處理
-        response_data = response.json()
-        reply = response_data["choices"][0]["message"]["content"].strip()
-        push_to_line(user_id, reply)
+        params = dict(GPT_ANSWER_PARAMS, messages=messages)
+        if not GPT_STREAMING:
+            with metrics.stage_timer("gpt"):
+                reply = chat_completion(**params)
+            push_to_line(user_id, reply)
+            save_reply(session, history, reply)
+            if cache_key is not None:
+                answer_cache.complete(cache_key, reply)
+            return
+
+        # 串流：第一段一產生就推播，之後以段落為單位陸續送出
+        pushed = []
+        def send(user_id, texts):
+            pushed.extend(texts)
+            return push_texts(user_id, texts)
+        try:
+            # 串流時 gpt 階段從送出請求算到最後一段文字，期間的推播另外記在 push 階段
+            with metrics.stage_timer("gpt"):
+                reply = stream_to_line(user_id, chat_completion_stream(**params), send=send)
+        except Exception as e:
+            if not pushed:
+                raise
+            print("❌ GPT 串流中斷:", e)
+            push_to_line(user_id, "⚠️ 回答產生到一半中斷，以上內容可能不完整，請稍後再試。")
+            if cache_key is not None:
+                answer_cache.fail(cache_key, GPT_ERROR_REPLY)
+            return
+        save_reply(session, history, reply)
+        if cache_key is not None:
+            answer_cache.complete(cache_key, reply)
 
     except Exception as e:
         print("❌ GPT 呼叫失敗:", e)
         push_to_line(user_id, "抱歉，我目前無法完成此查詢，請稍後再試。")
+        if cache_key is not None:
+            answer_cache.fail(cache_key, GPT_ERROR_REPLY)
 
 def push_to_line(user_id, reply):
-    # 使用 LINE Push API 主動推送結果
-    line_api_url = "https://api.line.me/v2/bot/message/push"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"
-    }
-    payload = {
-        "to": user_id,
-        "messages": [{"type": "text", "text": reply}]
-    }
-    response = requests.post(line_api_url, headers=headers, json=payload)
-    if response.status_code == 200:
-        print("✅ 成功推送訊息至 LINE")
-    else:
-        print(f"❌ 推送訊息失敗：{response.status_code}, {response.text}")
-
+    # 送出背景完成的結果：有保留的 reply token 就先用 Reply API，否則推播；過長的回答自動切段、每 5 則一批
+    push_texts(user_id, [reply])
+
+
+# 存活檢查：process 還在就回 200
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# 就緒檢查：規範資料與索引都已載入才回 200，否則回 503 讓負載平衡器先不要導流
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = dict(
+        knowledge_base.stats(),
+        pipe_classes=len(pipe_class_library),
+        pid=os.getpid(),
+        gpt_pool=gpt_executor.stats(),
+        answer_cache=answer_cache.stats(),
+        line_delivery=delivery.stats(),
+        startup=startup_phases,
+    )
+    loaded = status["type_links"] and status["piping_specification"] and status["piping_heat_treatment"]
+    status["ready"] = bool(loaded)
+    return jsonify(status), 200 if loaded else 503
+
+# 立即重新載入規範資料（未設定 ADMIN_TOKEN 時不開放）；?force=1 不比對 mtime 全部重讀
+# 只會更新接到這個請求的 worker，其他 worker 由各自的檔案監看更新
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    # compare_digest 比較 str 時只接受 ASCII，header 含其他字元會丟出 TypeError，因此比較 bytes
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"error": "not found"}), 404
+    try:
+        changed = knowledge_base.reload(force=request.args.get("force") == "1")
+    except ValueError as e:
+        return jsonify(dict(knowledge_base.stats(), reloaded=False, error=str(e))), 422
+    return jsonify(dict(knowledge_base.stats(), reloaded=bool(changed), changed=changed, pid=os.getpid()))
+
+# Prometheus 指標：各階段耗時（依 intent）、快取命中、模糊比對候選數、外部服務錯誤、背景工作數
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+mark_startup_phase("routes")
+startup_phases["total"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+print(f"🚀 啟動完成 {startup_phases['total']:.0f} ms（"
+      f"匯入模組 {startup_phases['imports']:.0f} ms、"
+      f"規範索引 {startup_phases['knowledge']:.0f} ms（快照：{'、'.join(knowledge_base.from_snapshot) or '無'}）、"
+      f"快取與其他資料 {startup_phases['caches']:.0f} ms）")
+
+# WSGI app factory：規範 JSON、type_links 與搜尋索引在 import 本模組時就已載入，
+# 搭配 gunicorn preload_app 時只會在 master 載入一次，fork 後各 worker 以 copy-on-write 共用
+# （檔案更新後各 worker 會各自建立新版索引）
+def create_app():
+    return app
 
 if __name__ == "__main__":
+    # 收到 SIGTERM 時正常結束，讓 atexit 等待背景 GPT 工作完成後再關閉
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
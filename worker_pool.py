@@ -0,0 +1,87 @@
+import atexit
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+
+# 有上限的背景工作池：最多 max_workers 個執行緒，排隊中的工作最多 max_queue 筆
+# 佇列已滿時 submit 直接回傳 None，由呼叫端回覆使用者「忙碌中」
+class BoundedExecutor:
+    def __init__(self, max_workers=8, max_queue=32, name="worker"):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = BoundedSemaphore(max_workers + max_queue)
+        self._lock = Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closed or not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            print(f"⚠️ {self.name} 工作池已滿，拒絕新工作（排隊 {self._pending} 筆）")
+            return None
+
+        submitted_at = time.monotonic()
+        # 背景工作沿用送出時的 context（例如計量用的 intent 標籤）
+        context = contextvars.copy_context()
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            waited = time.monotonic() - submitted_at
+            with self._lock:
+                self._pending -= 1
+                self._running += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                self._slots.release()
+
+        try:
+            return self._executor.submit(run)
+        except RuntimeError:
+            # 關閉中的 executor 不再接受工作
+            with self._lock:
+                self._pending -= 1
+                self._rejected += 1
+            self._slots.release()
+            return None
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self._pending,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._wait_total / started if started else 0.0,
+                "max_wait_seconds": self._wait_max,
+            }
+
+    # 停止接受新工作，並等待已排隊與執行中的工作完成
+    def shutdown(self, wait=True):
+        if self._closed:
+            return
+        self._closed = True
+        stats = self.stats()
+        if stats["queued"] or stats["running"]:
+            print(f"⏳ 等待 {self.name} 工作池完成剩餘工作（執行中 {stats['running']}，排隊 {stats['queued']}）")
+        self._executor.shutdown(wait=wait)
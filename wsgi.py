@@ -0,0 +1,4 @@
+# 正式環境入口：gunicorn -c gunicorn.conf.py wsgi:app
+from webhook import create_app
+
+app = create_app()